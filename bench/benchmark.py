@@ -0,0 +1,356 @@
+"""
+Benchmarks for the data model and feature extraction, run on synthetic
+forums. Usage:
+
+  python bench/benchmark.py [name ...]
+
+runs the named benchmarks (all of them by default). The old
+implementations that they are timed and checked against are in
+tests/reference.py.
+"""
+import os
+import sys
+import time
+import random
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'tests'))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from DataModel import Forum
+from reference import ( legacy_parse_sentences, legacy_surface_counts, LegacyCleanPost
+                      , legacy_writexml, legacy_sample )
+
+WORDS = ( "the a to is it of and in that you for on with this have are be not "
+          "linux ubuntu debian kernel install driver error version update please "
+          "thanks help problem file system works try using package noob newbie "
+          "2.6.32 3.14 v1.2 e.g. U.S.A. www.example.com http://example.com/x.html "
+          ":) ;) :( (H) :-O LOL OK WTF <a href=\"http://example.com\">link</a>"
+        ).split()
+ENDS = [' ', ' ', ' ', ' ', ', ', '. ', '? ', '! ', '.\n', '\n']
+
+def synthetic_text(rng, words):
+  return ''.join(rng.choice(WORDS) + rng.choice(ENDS) for i in xrange(words))
+
+def synthetic_forum( threads=100, posts_per_thread=20, words_per_post=50
+                   , authors=50, seed=0, forum=None
+                   ):
+  """
+  Build a forum of random threads. posts_per_thread and words_per_post
+  are upper bounds; the actual counts are drawn uniformly from 1..bound.
+  """
+  rng = random.Random(seed)
+  if forum is None:
+    forum = Forum('synthetic')
+  names = ['user%d' % i for i in xrange(authors)]
+  date = 1262304000.0
+  post_id = 0
+  for t in xrange(threads):
+    thread_id = str(t)
+    initiator = rng.choice(names)
+    forum.add_Thread(thread_id, synthetic_text(rng, 5), initiator, date)
+    for p in xrange(rng.randint(1, posts_per_thread)):
+      author = initiator if p == 0 else rng.choice(names)
+      date += rng.randint(1, 3600)
+      text = synthetic_text(rng, rng.randint(1, words_per_post))
+      forum.add_Post(thread_id, str(post_id), 'Re: ' + thread_id, author, date, text)
+      post_id += 1
+  return forum
+
+def timed(fn, *args, **kwargs):
+  """
+  Run fn once, returning (seconds, result).
+  """
+  start = time.time()
+  result = fn(*args, **kwargs)
+  return time.time() - start, result
+
+def report(name, seconds, baseline=None):
+  if baseline is None:
+    print "  %-40s %8.3fs" % (name, seconds)
+  else:
+    print "  %-40s %8.3fs  (%.1fx)" % (name, seconds, baseline / seconds if seconds else float('inf'))
+
+def near_duplicate_forum(threads=1000, vocabulary=5000, words=100, duplicates=0.3, seed=0):
+  """
+  Build a forum of single-post threads over a large vocabulary, where a
+  fraction of the threads are edited copies of an earlier thread.
+  """
+  rng = random.Random(seed)
+  forum = Forum('near_duplicates')
+  texts = []
+  for t in xrange(threads):
+    if texts and rng.random() < duplicates:
+      text = list(rng.choice(texts))
+      for i in xrange(rng.randint(0, words // 3)):
+        text[rng.randrange(words)] = 'w%d' % rng.randrange(vocabulary)
+    else:
+      text = ['w%d' % rng.randrange(vocabulary) for i in xrange(words)]
+    texts.append(text)
+    forum.add_Thread(str(t), '', 'user', 1262304000.0 + t)
+    forum.add_Post(str(t), str(t), '', 'user', 1262304000.0 + t, ' '.join(text))
+  return forum
+
+#####
+# Benchmarks
+#####
+def bench_position(posts=10000):
+  """
+  Post.position and neighbour walks over one long thread.
+  """
+  forum = synthetic_forum(threads=1, posts_per_thread=1, words_per_post=1)
+  thread = forum.threads[0]
+  for i in xrange(posts):
+    forum.add_Post(thread.id, 'long%d' % i, '', 'user%d' % (i % 7), 1262304000.0 + i, 'text')
+  # The linear scan is slow enough that we only time every 10th post.
+  sample = thread.posts[::10]
+  print "position of %d posts on a thread of %d posts" % (len(sample), len(thread.posts))
+
+  def scan():
+    return [thread.posts.index(p) for p in sample]
+  def stored():
+    return [p.position for p in sample]
+  def walk():
+    p = thread.posts[0]
+    while p is not None:
+      p = p.next_by_thread()
+
+  t_scan, expected = timed(scan)
+  t_stored, result = timed(stored)
+  assert result == expected
+  report('list.index (previous behaviour)', t_scan)
+  report('Post.position', t_stored, t_scan)
+  report('next_by_thread walk', timed(walk)[0])
+
+def bench_minhash(threads=2000, n=0.5):
+  """
+  Recall and speed of ApproximateTextSimilarityNetwork against the
+  exact TextSimilarityNetwork.
+  """
+  from DataModel import rbp_tokenize
+  from social_network_analysis import TextSimilarityNetwork, ApproximateTextSimilarityNetwork
+  forum = near_duplicate_forum(threads)
+  forum.run_tokenizer(rbp_tokenize)
+  print "text similarity >= %s between %d threads" % (n, threads)
+
+  t_exact, exact = timed(TextSimilarityNetwork, forum, n)
+  exact_edges = set(frozenset(e) for e in exact.edges())
+  report('exact (%d edges)' % len(exact_edges), t_exact)
+  for bands, rows in [(20, 5), (30, 3), (40, 3), (50, 2)]:
+    t, approx = timed(ApproximateTextSimilarityNetwork, forum, n, bands=bands, rows=rows)
+    found = set(frozenset(e) for e in approx.edges())
+    recall = len(found & exact_edges) / float(len(exact_edges)) if exact_edges else 1.0
+    report('minhash bands=%d rows=%d recall=%.3f' % (bands, rows, recall), t, t_exact)
+
+def bench_tokenize(threads=2000, workers=(2, 4, 8)):
+  """
+  Forum.run_tokenizer with a pool of worker processes against the serial
+  path.
+  """
+  import multiprocessing
+  from DataModel import rbp_tokenize
+  forum = synthetic_forum(threads=threads, words_per_post=200)
+  print "tokenize %d posts (%d cpus)" % (len(forum.posts), multiprocessing.cpu_count())
+
+  t_serial = timed(forum.run_tokenizer, rbp_tokenize)[0]
+  expected = [dict(p.token_index) for p in forum.posts]
+  report('serial', t_serial)
+  for n in workers:
+    t = timed(forum.run_tokenizer, rbp_tokenize, workers=n)[0]
+    assert [dict(p.token_index) for p in forum.posts] == expected
+    report('workers=%d' % n, t, t_serial)
+
+def bench_sentences(threads=500):
+  """
+  parse_sentences and iter_sentences against the legacy splitter, which
+  they must agree with exactly.
+  """
+  from DataModel import parse_sentences, iter_sentences
+  forum = synthetic_forum(threads=threads, words_per_post=200)
+  texts = [p.text for p in forum.posts]
+  texts += [t.decode('utf8') + u' caf\xe9 na\xefve.' for t in texts[:len(texts) // 10]]
+  print "split %d texts (%d bytes) into sentences" % (len(texts), sum(len(t) for t in texts))
+
+  def run(fn):
+    return [[(list(s), s.end) for s in fn(t)] for t in texts]
+  t_legacy, expected = timed(run, legacy_parse_sentences)
+  report('legacy parse_sentences', t_legacy)
+  for fn in (parse_sentences, iter_sentences):
+    t, result = timed(run, fn)
+    assert result == expected
+    report(fn.__name__, t, t_legacy)
+
+def bench_vocabulary(threads=300, words=300, pairs=5000):
+  """
+  overlap and cosine_similarity between thread token indexes, as dicts
+  of token strings and as TokenIndexes after Forum.intern_tokens.
+  """
+  import common
+  from DataModel import rbp_tokenize
+  forum = near_duplicate_forum(threads, words=words)
+  forum.run_tokenizer(rbp_tokenize)
+  rng = random.Random(0)
+  pairs = [(rng.randrange(threads), rng.randrange(threads)) for i in xrange(pairs)]
+  print "%d thread pairs of ~%d tokens" % (len(pairs), words)
+
+  def run(metric):
+    T = forum.threads
+    return [metric(T[i].token_index, T[j].token_index) for i, j in pairs]
+  metrics = [common.overlap, common.cosine_similarity]
+  baseline = [timed(run, metric) for metric in metrics]
+  for metric, (t, result) in zip(metrics, baseline):
+    report('%s (dict)' % metric.__name__, t)
+  forum.intern_tokens()
+  for metric, (t_dict, expected) in zip(metrics, baseline):
+    t, result = timed(run, metric)
+    assert result == expected
+    report('%s (TokenIndex)' % metric.__name__, t, t_dict)
+
+def edge_set(net):
+  """
+  The edges of a network with their data, comparable across graphs.
+  """
+  if net.is_directed():
+    return set((id(A), id(B), tuple(d.items())) for A, B, d in net.edges_iter(data=True))
+  return set((frozenset([id(A), id(B)]), tuple(d.items())) for A, B, d in net.edges_iter(data=True))
+
+def bench_network_cache(threads=1000):
+  """
+  Computing networks against loading them from a NetworkCache. The
+  forum fingerprint, which the cache needs once per lookup, is timed
+  separately, and again once the forum has memoized its content hash.
+  """
+  import os
+  import tempfile
+  from DataModel import rbp_tokenize
+  from social_network_analysis import ( NetworkCache, forum_fingerprint, ThreadParticipationNetwork
+                                      , PostAfterCountsNetwork, TextSimilarityNetwork )
+  forum = synthetic_forum(threads=threads, authors=200)
+  forum.run_tokenizer(rbp_tokenize)
+  path = os.path.join(tempfile.mkdtemp(), 'networks.db')
+  print "networks over %d threads, %d authors" % (threads, len(forum.authors))
+  t, fingerprint = timed(forum_fingerprint, forum)
+  report('forum_fingerprint', t)
+  t_again, again = timed(forum_fingerprint, forum)
+  assert again == fingerprint
+  report('forum_fingerprint (memoized)', t_again, t)
+  with NetworkCache(path) as cache:
+    for net_fn, kwargs in [ (ThreadParticipationNetwork, {'k': 2})
+                          , (PostAfterCountsNetwork, {})
+                          , (TextSimilarityNetwork, {'n': 0.4})
+                          ]:
+      key = (net_fn.__name__, fingerprint, frozenset(kwargs.items()))
+      t_compute, net = timed(net_fn, forum, **kwargs)
+      cache.put(key, net, forum)
+      t_load, cached = timed(cache.get, key, forum)
+      assert edge_set(net) == edge_set(cached)
+      name = '%s (%d edges)' % (net_fn.__name__, net.number_of_edges())
+      report(name + ' computed', t_compute)
+      report(name + ' loaded', t_load, t_compute)
+  os.remove(path)
+
+def bench_surface(threads=500):
+  """
+  Throughput of wanas.SurfaceScanner against the separate emoticon, link
+  and capital scans it replaces.
+  """
+  from common import messenger_emoticons
+  from wanas import SurfaceScanner
+  forum = synthetic_forum(threads=threads, words_per_post=200)
+  texts = [p.text for p in forum.posts]
+  size = sum(len(t) for t in texts) / 1e6
+  print "emoticons, links and capitals in %d texts (%.1f MB)" % (len(texts), size)
+
+  scanner = SurfaceScanner(messenger_emoticons)
+  t_legacy, expected = timed(map, legacy_surface_counts, texts)
+  t, result = timed(map, scanner, texts)
+  assert result == expected
+  report('separate scans (%.1f MB/s)' % (size / t_legacy), t_legacy)
+  report('SurfaceScanner (%.1f MB/s)' % (size / t), t, t_legacy)
+
+HTML = ( '<p>', '</p>', '<b>', '</b>', '<a href="http://example.com/">', '</a>'
+       , '<img src="smile.gif" alt=":)" />', '&amp;', '&quot;', '&nbsp;', '&foo;', '<br />\n'
+       )
+
+def synthetic_html(rng, words):
+  """
+  A post of words with tags and entities mixed in.
+  """
+  return ''.join( rng.choice(HTML) if rng.random() < 0.1 else rng.choice(WORDS) + rng.choice(ENDS)
+                  for i in xrange(words) )
+
+def bench_clean(posts=2000, words=400, huge=200000):
+  """
+  common.CleanPost against the legacy class, on many posts (also through
+  clean_posts with a pool) and on one huge post.
+  """
+  from common import CleanPost, clean_posts
+  rng = random.Random(0)
+  texts = [synthetic_html(rng, rng.randint(1, words)) for i in xrange(posts)]
+  print "clean %d html posts (%d bytes)" % (len(texts), sum(len(t) for t in texts))
+  legacy = LegacyCleanPost()
+  t_legacy, expected = timed(map, legacy, texts)
+  report('legacy CleanPost', t_legacy)
+  t, result = timed(map, CleanPost(), texts)
+  assert result == expected
+  report('CleanPost', t, t_legacy)
+  t, result = timed(clean_posts, texts, workers=4)
+  assert result == expected
+  report('clean_posts workers=4', t, t_legacy)
+
+  text = synthetic_html(rng, huge)
+  print "clean one post of %d bytes" % len(text)
+  t_legacy, expected = timed(legacy, text)
+  report('legacy CleanPost', t_legacy)
+  t, result = timed(CleanPost(), text)
+  assert result == expected
+  report('CleanPost', t, t_legacy)
+
+def bench_writexml(threads=2000):
+  """
+  Forum.writexml, streaming through XMLWriter, against the legacy
+  element tree writer, which must produce the same bytes.
+  """
+  from cStringIO import StringIO
+  forum = synthetic_forum(threads=threads, words_per_post=100)
+  print "write %d threads, %d posts as xml" % (threads, len(forum.posts))
+  f = StringIO()
+  t_legacy = timed(legacy_writexml, forum, f)[0]
+  expected = f.getvalue()
+  report('legacy writexml', t_legacy)
+  f = StringIO()
+  t = timed(forum.writexml, f)[0]
+  assert f.getvalue() == expected
+  report('writexml', t, t_legacy)
+
+def bench_sample(threads=5000, k=2500):
+  """
+  Forum.sample and Forum.sample_view, which returns a sampling.ForumView,
+  against the old Forum.sample, which seeded the random module.
+  """
+  forum = synthetic_forum(threads=threads)
+  print "sample %d of %d threads (%d posts)" % (k, threads, len(forum.posts))
+  t_legacy, expected = timed(legacy_sample, forum, k, seed=0)
+  report('legacy sample', t_legacy)
+  for name in ('sample', 'sample_view'):
+    t, result = timed(getattr(forum, name), k, seed=0)
+    assert [p.id for p in result.posts] == [p.id for p in expected.posts]
+    report(name, t, t_legacy)
+
+BENCHMARKS = [ bench_position
+             , bench_minhash
+             , bench_tokenize
+             , bench_sentences
+             , bench_vocabulary
+             , bench_network_cache
+             , bench_surface
+             , bench_clean
+             , bench_writexml
+             , bench_sample
+             ]
+
+if __name__ == '__main__':
+  names = sys.argv[1:]
+  for bench in BENCHMARKS:
+    if not names or bench.__name__ in names or bench.__name__[6:] in names:
+      bench()
@@ -3,6 +3,8 @@ import datetime as dt
 import time
 from collections import defaultdict
 from cStringIO import StringIO
+import multiprocessing
+import hashlib
 import xml.etree.cElementTree as etree
 from cStringIO import StringIO
 import random
@@ -17,31 +19,181 @@ control_char_re = re.compile('[%s]' % re.escape(control_chars))
 def clean(s):
     return control_char_re.sub('', s)
 
-def load_xml(file):
-  tree = etree.parse(file)
-  title = tree.find('title').text
-  forum = Forum(title)
-  for t_node in tree.findall('thread'):
-    thread_id = t_node.get('id')
-    title = unescape(t_node.find('title').text or '')
-    author = unescape(t_node.find('author').text or '')
-    date = float(t_node.find('date').text)
-    forum.add_Thread(thread_id, title, author, date)
-    for p_node in t_node.findall('post'):
-      post_id = p_node.get('id')
-      title = unescape(p_node.find('title').text or '')
-      author = unescape(p_node.find('author').text or '')
-      date = float(p_node.find('date').text)
-      t = p_node.find('text').text
-      # Undo the cleverness from etree in detecting and returning
-      # utf8 nodes.
-      #if type(author) == unicode:    author = author.encode('utf8')
-      #if type(title) == unicode:     title = title.encode('utf8')
-      if type(t) == unicode:         t = t.encode('utf8')
-      text = unescape(t if t is not None else '')
-      forum.add_Post(thread_id, post_id, title, author, date, text)
+# Version of the xml -> Forum conversion (load_xml and clean). Bump this
+# whenever a change would produce different objects from the same xml,
+# so that snapshots built by the previous version get rebuilt.
+PARSER_VERSION = 1
+
+def _read_thread(forum, t_node):
+  """
+  Add the thread described by a <thread> element, and all of its
+  posts, to forum.
+  """
+  thread_id = t_node.get('id')
+  title = unescape(t_node.find('title').text or '')
+  author = unescape(t_node.find('author').text or '')
+  date = float(t_node.find('date').text)
+  forum.add_Thread(thread_id, title, author, date)
+  for p_node in t_node.findall('post'):
+    post_id = p_node.get('id')
+    title = unescape(p_node.find('title').text or '')
+    author = unescape(p_node.find('author').text or '')
+    date = float(p_node.find('date').text)
+    t = p_node.find('text').text
+    # Undo the cleverness from etree in detecting and returning
+    # utf8 nodes.
+    #if type(author) == unicode:    author = author.encode('utf8')
+    #if type(title) == unicode:     title = title.encode('utf8')
+    if type(t) == unicode:         t = t.encode('utf8')
+    text = unescape(t if t is not None else '')
+    forum.add_Post(thread_id, post_id, title, author, date, text)
+  return forum[thread_id]
+
+def _iterparse(file):
+  """
+  Walk a forum xml file incrementally, yielding ('title', text) for the
+  forum title and ('thread', element) for each complete <thread>
+  element. Each thread element is cleared once the consumer resumes,
+  and detached from the root, so only one thread is held in memory at
+  a time.
+  """
+  depth = 0
+  root = None
+  for event, elem in etree.iterparse(file, events=('start', 'end')):
+    if event == 'start':
+      if root is None:
+        root = elem
+      depth += 1
+      continue
+    depth -= 1
+    if depth != 1:
+      continue
+    if elem.tag == 'title':
+      yield 'title', elem.text
+    elif elem.tag == 'thread':
+      yield 'thread', elem
+    elem.clear()
+    root.remove(elem)
+
+def load_xml(file, columnar=False):
+  """
+  Load a forum from xml. With columnar=True the forum keeps its threads
+  and posts in a columnar.ColumnStore, which takes far less memory for
+  large forums.
+  """
+  if columnar:
+    from columnar import ColumnarForum
+    forum = ColumnarForum(None)
+  else:
+    forum = Forum(None)
+  for kind, value in _iterparse(file):
+    if kind == 'title':
+      forum.title = value
+    else:
+      _read_thread(forum, value)
   return forum 
 
+def iter_xml(file):
+  """
+  Generator mode for load_xml. Yields one thread at a time, each in a
+  Forum of its own (carrying the title of the forum being read), so
+  that processing a forum does not require holding all of it in memory.
+  """
+  title = None
+  for kind, value in _iterparse(file):
+    if kind == 'title':
+      title = value
+    else:
+      yield _read_thread(Forum(title), value)
+
+# Characters that XML 1.0 does not allow, not even as character
+# references, so a document containing them could not be read back.
+invalid_xml_re = re.compile(u'[^\t\n\r\u0020-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]')
+
+def check_xml_chars(value):
+  """
+  Raise ValueError if value contains a character that cannot be written
+  to xml.
+  """
+  m = invalid_xml_re.search(value)
+  if m is not None:
+    raise ValueError, "%r cannot be written to xml" % m.group()
+
+def _xml_text(value):
+  # As ElementTree escapes text when writing us-ascii.
+  value = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+  return value.encode('us-ascii', 'xmlcharrefreplace')
+
+def _xml_attrib(value):
+  # As ElementTree escapes attribute values when writing us-ascii.
+  value = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+  value = value.replace('"', '&quot;').replace('\n', '&#10;')
+  return value.encode('us-ascii', 'xmlcharrefreplace')
+
+class XMLWriter(object):
+  """
+  Writes a forum as xml one thread at a time, so that the forum never
+  has to be held in memory as an element tree. The output is the same
+  as Forum.writexml's: text fields are escaped once by us and once more
+  by the xml encoding, and with pretty=True elements are indented two
+  spaces per level. Each thread is checked with check_xml_chars before
+  any of it is written. Usage:
+
+    with XMLWriter(f, forum.title) as writer:
+      for thread in threads:
+        writer.write_thread(thread)
+  """
+  def __init__(self, file, title, pretty=True):
+    self.file = file
+    self.pretty = pretty
+    check_xml_chars(title)
+    self.file.write('<forum>' + self._element(1, 'title', title, escaped=False))
+
+  def _indent(self, level):
+    return '\n' + '  ' * level if self.pretty else ''
+
+  def _element(self, level, tag, value, escaped=True):
+    if escaped:
+      value = escape(value)
+    if not value:
+      return '%s<%s />' % (self._indent(level), tag)
+    return '%s<%s>%s</%s>' % (self._indent(level), tag, _xml_text(value), tag)
+
+  def _fields(self, level, item):
+    return ( self._element(level, 'title', item.title)
+           + self._element(level, 'author', item.author)
+           + self._element(level, 'date', str(time.mktime(item.date.timetuple())), escaped=False)
+           )
+
+  def write_thread(self, thread):
+    posts = thread.posts
+    for value in (thread.id, thread.title, thread.author):
+      check_xml_chars(value)
+    for post in posts:
+      for value in (post.id, post.title, post.author, post.text):
+        check_xml_chars(value)
+
+    out = [ '%s<thread id="%s">' % (self._indent(1), _xml_attrib(thread.id))
+          , self._fields(2, thread)
+          ]
+    for post in posts:
+      out.append('%s<post id="%s">' % (self._indent(2), _xml_attrib(post.id)))
+      out.append(self._fields(3, post))
+      out.append(self._element(3, 'text', post.text))
+      out.append('%s</post>' % self._indent(2))
+    out.append('%s</thread>' % self._indent(1))
+    self.file.write(''.join(out))
+
+  def close(self):
+    self.file.write(self._indent(0) + '</forum>' + self._indent(0))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    if type is None:
+      self.close()
+
 class Forum(object):
   def __init__(self, title):
     self.title = title
@@ -52,7 +204,12 @@ class Forum(object):
     self.authors = defaultdict(Author) 
     self.token_index = None
     self.tokenizer = None
-
+    # Set by intern_tokens
+    self.vocabulary = None
+    # Threads with posts added since the forum was tokenized
+    self.dirty_threads = []
+    # (title, digest) of the last content_hash
+    self._content_hash = None
 
   def __eq__(self, other):
     return self.threads == other.threads
@@ -67,6 +224,23 @@ class Forum(object):
                                                             , len(self.authors)
                                                             )
 
+  @property
+  def content_hash(self):
+    """
+    A hex digest of the forum title and the content_hash of every thread.
+    It is worked out once, and kept until the title changes, threads or
+    posts are added, the title or text of a thread or post is set, or
+    the posts of a thread are reordered (see Thread.reindex, which must
+    also be called after editing thread.posts directly).
+    """
+    if self._content_hash is None or self._content_hash[0] != self.title:
+      h = hashlib.sha1()
+      h.update((self.title or '').encode('utf8') if isinstance(self.title, unicode) else (self.title or ''))
+      for thread in self.threads:
+        h.update(thread.content_hash)
+      self._content_hash = (self.title, h.hexdigest())
+    return self._content_hash[1]
+
   @property
   def xml(self):
     b = etree.TreeBuilder()
@@ -86,62 +260,232 @@ class Forum(object):
     return e
 
   def sample(self, k, seed=None):
+    """
+    A new Forum holding copies of k threads drawn at random. The threads
+    are those random.sample picks after random.seed(seed), but the state
+    of the random module is left alone.
+    """
     assert k <= len(self.threads), "Not enough threads to sample"
-    random.seed(seed)
+    rng = random.Random(seed)
     subforum = Forum(self.title+'_(k:%d,seed:%s)'%(k,str(seed)))
-    for thread in random.sample(self.threads, k):
+    for thread in rng.sample(self.threads, k):
       subforum.add_Thread(thread.id, thread.title, thread.author, time.mktime(thread.date.timetuple()))
       for post in thread.posts:
         subforum.add_Post(thread.id, post.id, post.title, post.author, time.mktime(post.date.timetuple()), post.text)
     return subforum
 
+  def sample_view(self, k, seed=None):
+    """
+    The same k threads as sample(k, seed), as a read-only
+    sampling.ForumView, which is much cheaper to build.
+    """
+    from sampling import sample
+    return sample(self, k, seed)
 
-  def writexml(self, writer):
-    # from http://effbot.org/zone/element-lib.htm#prettyprint
-    def indent(elem, level=0):
-        i = "\n" + level*"  "
-        if len(elem):
-            if not elem.text or not elem.text.strip():
-                elem.text = i + "  "
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = i
-            for elem in elem:
-                indent(elem, level+1)
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = i
-        else:
-            if level and (not elem.tail or not elem.tail.strip()):
-                elem.tail = i
-    e = self.xml
-    indent(e)
-    tree = etree.ElementTree(e)
-    tree.write(writer)
+  def filter(self, predicate):
+    """
+    A sampling.ForumView of the threads for which predicate(thread) is
+    true.
+    """
+    from sampling import ForumView
+    return ForumView(self, [t for t in self.threads if predicate(t)])
+
+  def split(self, fraction, seed=None):
+    """
+    Split the threads at random into two sampling.ForumViews, e.g. a
+    training set with a fraction of the threads and a test set with the
+    rest. See sampling.split.
+    """
+    from sampling import split
+    return split(self, fraction, seed)
+
+
+  def save_snapshot(self, path):
+    """
+    Write this forum to a binary snapshot. See the snapshot module.
+    """
+    from snapshot import save_snapshot
+    save_snapshot(self, path)
+
+  @staticmethod
+  def load_snapshot(path):
+    """
+    Load a forum from a snapshot written by save_snapshot. Raises
+    ValueError if the snapshot was written by another parser version.
+    """
+    from snapshot import load_snapshot
+    return load_snapshot(path)
+
+  def writexml(self, writer, pretty=True):
+    """
+    Write the forum as xml to writer, a file or a file name, one thread
+    at a time. See XMLWriter.
+    """
+    f = writer if hasattr(writer, 'write') else open(writer, 'wb')
+    try:
+      with XMLWriter(f, self.title, pretty) as xml_writer:
+        for thread in self.threads:
+          xml_writer.write_thread(thread)
+    finally:
+      if f is not writer:
+        f.close()
   
+  def new_Thread(self, thread_id, title, author, date):
+    """
+    Build a thread of this forum. Subclasses that store their threads
+    differently (e.g. columnar.ColumnarForum) override this, not add_Thread.
+    """
+    return Thread(thread_id, title, author, date, self)
+
   def add_Thread(self, thread_id, title, author, date):
-    thread = Thread(thread_id, clean(title), clean(author), date, self)
+    thread = self.new_Thread(thread_id, clean(title), clean(author), date)
+    self._content_hash = None
     self.threads.append(thread)
     self.thread_dict[thread_id] = thread
     self.authors[author].add_Thread(thread)
+    self.mark_dirty(thread)
 
   def add_Post(self, thread_id, post_id, title, author, date, text):
     thread = self.thread_dict[thread_id]
     post = thread.add_Post(post_id, clean(title), clean(author), date, clean(text))
+    self._content_hash = None
     self.authors[author].add_Post(post)
     self.posts.append(post)
     self.post_dict[post_id] = (post)
+    if self.token_index is not None:
+      thread.new_posts.append(post)
+      self.mark_dirty(thread)
 
-  def run_tokenizer(self, tokenizer):
+  def attach_Thread(self, thread):
+    """
+    Add a thread that already exists, with its posts, without copying
+    it, e.g. one read by iter_xml. The thread moves to this forum:
+    thread.forum is set to it.
+    """
+    thread.forum = self
+    self._content_hash = None
+    self.threads.append(thread)
+    self.thread_dict[thread.id] = thread
+    self.authors[thread.author].add_Thread(thread)
+    for post in thread.posts:
+      self.authors[post.author].add_Post(post)
+      self.posts.append(post)
+      self.post_dict[post.id] = post
+    if self.token_index is not None:
+      # None of its posts are in the forum token index yet, and the
+      # thread's own index is rebuilt when they are added.
+      thread.token_index = None
+      thread.new_posts = list(thread.posts)
+      thread.dirty = False
+      self.mark_dirty(thread)
+
+  def mark_dirty(self, thread):
+    """
+    Note that thread has changed since the forum was tokenized. Nothing
+    needs tracking until the forum has been tokenized.
+    """
+    if self.token_index is not None and not thread.dirty:
+      thread.dirty = True
+      self.dirty_threads.append(thread)
+
+  def run_tokenizer(self, tokenizer, workers=None, chunksize=200):
+    """
+    Tokenize every post, and build the thread and forum token indexes.
+    With workers > 1 the posts are tokenized by a pool of that many
+    processes, in batches of chunksize posts; the tokenizer then needs
+    to be picklable, e.g. a module-level function like rbp_tokenize.
+    """
     self.tokenizer = tokenizer
     self.token_index = defaultdict(int)
+    parallel = workers is not None and workers > 1
+    if parallel:
+      tokenize_posts([p for t in self.threads for p in t.posts], tokenizer, workers, chunksize)
     for thread in self.threads:
-      thread.run_tokenizer(tokenizer)
+      if parallel:
+        thread.collect_tokens(tokenizer)
+      else:
+        thread.run_tokenizer(tokenizer)
       for token in thread.token_index:
         self.token_index[token] += thread.token_index[token]
+    for thread in self.dirty_threads:
+      thread.new_posts = []
+      thread.dirty = False
+    self.dirty_threads = []
+    if self.vocabulary is not None:
+      self.intern_tokens(self.vocabulary)
+
+  def intern_tokens(self, vocabulary=None):
+    """
+    Convert the token indexes of the forum and its threads and posts to
+    vocabulary.TokenIndex arrays of ids from one Vocabulary (the given
+    one, else the forum's, else a new one). From then on, tokenizing
+    the forum again produces TokenIndexes too.
+    """
+    from vocabulary import Vocabulary
+    if self.token_index is None:
+      raise ValueError, "Please run tokenizer first"
+    if vocabulary is None:
+      vocabulary = self.vocabulary if self.vocabulary is not None else Vocabulary()
+    self.vocabulary = vocabulary
+    self._intern(self.threads)
+
+  def _intern(self, threads):
+    """
+    Convert the token indexes of the given threads, their posts and the
+    forum to TokenIndexes over the forum's vocabulary.
+    """
+    from vocabulary import TokenIndex
+    vocabulary = self.vocabulary
+
+    def convert(e):
+      index = e.token_index
+      if index is not None and not (isinstance(index, TokenIndex) and index.vocabulary is vocabulary):
+        e.token_index = TokenIndex(vocabulary, index)
+    for thread in threads:
+      for post in thread.posts:
+        convert(post)
+      convert(thread)
+    convert(self)
+
+  def clear_cache(self):
+    """
+    Drop the sentences and stats cached by every post.
+    """
+    for thread in self.threads:
+      thread.clear_cache()
+
+  def update_tokens(self, tokenizer=None):
+    """
+    Bring the token indexes up to date after threads or posts have been
+    added, tokenizing only the new posts and adding their counts to the
+    thread and forum indexes. Falls back to run_tokenizer if the forum
+    has not been tokenized yet, was tokenized with another tokenizer, or
+    the text of a tokenized post has changed since.
+    """
+    if tokenizer is None:
+      tokenizer = self.tokenizer
+    if tokenizer is None:
+      raise ValueError, "Please run tokenizer first"
+    if self.token_index is None or tokenizer is not self.tokenizer:
+      self.run_tokenizer(tokenizer)
+      return
+    dirty = self.dirty_threads
+    delta = defaultdict(int)
+    for thread in dirty:
+      for token, count in thread.update_tokens(tokenizer).iteritems():
+        delta[token] += count
+    add_counts(self.token_index, delta)
+    self.dirty_threads = []
+    if self.vocabulary is not None:
+      # Only the changed threads can hold indexes that are not interned yet.
+      self._intern(dirty)
     
 class Author(object):
   def __init__(self):
     self.posts = []
     self.threads = []
+    self._all_threads = []
+    self._all_thread_ids = set()
 
   def __repr__(self):
     return "<author '%s' (%d posts in %d threads, initiated %d)>" % (self.name, len(self.posts), len(self.all_threads), len(self.threads))
@@ -163,26 +507,42 @@ class Author(object):
 
   @property
   def all_threads(self):
-    return list(set(p.thread for p in self.posts))
+    return list(self._all_threads)
 
   def add_Post(self, post):
     self.posts.append(post)
+    # Keep track of the threads posted in as we go.
+    if id(post.thread) not in self._all_thread_ids:
+      self._all_thread_ids.add(id(post.thread))
+      self._all_threads.append(post.thread)
 
   def add_Thread(self, thread):
     self.threads.append(thread)
 
-class Thread(object):
+class ThreadBase(object):
+  """
+  What a thread does, without where it keeps its attributes: the empty
+  __slots__ leaves that to the subclass, so that Thread can use an
+  instance dict and columnar.ThreadView slots.
+  """
+  __slots__ = ()
+
   def __init__(self, id, title, author, date, forum):
+    self.forum = forum
     self.id = unicode(id)
     self.title = title
     self.author = author
     self.date = dt.datetime.fromtimestamp(date)
-    self.forum = forum
     self.posts = []
     self.post_dict = {}
     self.token_index = None
     self.tokenizer = None
     self.post_authors = set()
+    # Posts added since the forum was tokenized, see Forum.update_tokens
+    self.new_posts = []
+    self.dirty = False
+    self._stats = None
+    self._positions = None
 
   def __eq__(self, other):
     return self.id == other.id
@@ -201,7 +561,7 @@ class Thread(object):
     return o.getvalue()
 
   def __contains__(self, item):
-    if isinstance(item, Post):
+    if isinstance(item, PostBase):
       return item in self.posts
     if isinstance(item, Author):
       return any(item.name == p.author for p in self.posts)
@@ -212,6 +572,16 @@ class Thread(object):
   def __iter__(self):
     return iter(self.posts)
 
+  def _get_title(self):
+    return self._title
+
+  def _set_title(self, title):
+    self._title = title
+    # The title is part of the forum content_hash.
+    self.forum._content_hash = None
+
+  title = property(_get_title, _set_title)
+
   @property
   def xml(self):
     b = etree.TreeBuilder()
@@ -240,19 +610,169 @@ class Thread(object):
 
   def add_Post(self, id, title, author, date, text):
     post = Post(id, title, author, date, text, self)
+    post._position = len(self.posts)
     self.posts.append(post)
     self.post_dict[id] = post
     self.post_authors.add(author)
+    self._stats = None
+    if self._positions is not None:
+      self._positions.setdefault(post.id, post._position)
     return post
 
+  def _copy_for(self, forum):
+    """
+    A copy of the thread and its posts that belongs to forum, for
+    sampling.ForumView. The copies share the field values and cached
+    sentences of the originals, but are not tokenized.
+    """
+    thread = type(self).__new__(type(self))
+    thread.__dict__.update(self.__dict__)
+    thread.forum = forum
+    thread.posts = []
+    thread.post_dict = {}
+    thread.post_authors = set()
+    thread.token_index = None
+    thread.tokenizer = None
+    thread.new_posts = []
+    thread.dirty = False
+    thread._stats = None
+    thread._positions = None
+    for post in self.posts:
+      post = post._copy_for(thread)
+      thread.posts.append(post)
+      thread.post_dict[post.id] = post
+      thread.post_authors.add(post.author)
+    return thread
+
+  @property
+  def content_hash(self):
+    """
+    A hex digest of the thread and all of its posts (ids, titles,
+    authors, dates and text), which changes whenever any of them does.
+    """
+    def fields(*values):
+      return '\0'.join(v.encode('utf8') if isinstance(v, unicode) else v for v in values)
+    h = hashlib.sha1(fields(self.id, self.title, self.author, self.date.isoformat(), str(len(self.posts))))
+    for p in self.posts:
+      h.update('\0')
+      h.update(fields(p.id, p.title, p.author, p.date.isoformat(), str(len(p.text)), p.text))
+    return h.hexdigest()
+
+  @property
+  def stats(self):
+    """
+    The ThreadStats of the thread, computed once and kept until posts
+    are added, reordered (see reindex) or have their text changed.
+    """
+    if self._stats is None:
+      self._stats = ThreadStats(self)
+    return self._stats
+
+  def first_positions(self):
+    """
+    Map each post id to the position of the first post with that id, as
+    posts.index would find it. Unlike stats this is cheap to keep: add_Post
+    extends it and only reindex drops it.
+    """
+    if self._positions is None:
+      positions = {}
+      for i, p in enumerate(self.posts):
+        positions.setdefault(p.id, i)
+      self._positions = positions
+    return self._positions
+
+  def reindex(self):
+    """
+    Record each post's position in the thread. Needs to be called if
+    self.posts is reordered or modified directly; Post.position also
+    does this itself when it notices a stale position.
+    """
+    for i, post in enumerate(self.posts):
+      post._position = i
+    self._stats = None
+    self._positions = None
+    # Post order is part of the forum content_hash.
+    self.forum._content_hash = None
+
+  def sort_posts(self, key=None):
+    """
+    Sort the posts of the thread, by date unless a key is given.
+    """
+    self.posts.sort(key=key)
+    self.reindex()
+
   def run_tokenizer(self, tokenizer):
+    for post in self.posts:
+      post.run_tokenizer(tokenizer)
+    self.collect_tokens(tokenizer)
+
+  def clear_cache(self):
+    for post in self.posts:
+      post.clear_cache()
+
+  def collect_tokens(self, tokenizer):
+    """
+    Build the token index from those of the posts, which must already
+    have been tokenized with tokenizer.
+    """
     self.tokenizer = tokenizer
     self.token_index = defaultdict(int)
     for post in self.posts:
-      post.run_tokenizer(tokenizer)
       for token in post.token_index:
         self.token_index[token] += post.token_index[token]
 
+  def update_tokens(self, tokenizer):
+    """
+    Tokenize the posts in self.new_posts and add them to the token index.
+    Returns the token counts of the new posts. A thread without a token
+    index (e.g. one added since the forum was tokenized) collects it from
+    its posts, tokenizing only those that are not tokenized yet.
+    """
+    delta = defaultdict(int)
+    for post in self.new_posts:
+      post.run_tokenizer(tokenizer)
+      for token in post.token_index:
+        delta[token] += post.token_index[token]
+    if self.token_index is None or tokenizer is not self.tokenizer:
+      for post in self.posts:
+        if post.token_index is None or post.tokenizer is not tokenizer:
+          post.run_tokenizer(tokenizer)
+      self.collect_tokens(tokenizer)
+    else:
+      add_counts(self.token_index, delta)
+    self.new_posts = []
+    self.dirty = False
+    return delta
+
+class Thread(ThreadBase):
+  pass
+
+class ThreadStats(object):
+  """
+  Per-thread statistics that post features are computed relative to,
+  so that they are only worked out once per thread: the gaps between
+  consecutive posts with their total and mean, the post lengths with
+  their mean, and the position of each post id (the first, as
+  posts.index would find it). by_date, the posts sorted by date, is
+  worked out the first time it is asked for.
+  """
+  def __init__(self, thread):
+    posts = thread.posts
+    self.positions = thread.first_positions()
+    self.gaps = [q.date - p.date for p, q in zip(posts, posts[1:])]
+    self.total_gap = sum(self.gaps, dt.timedelta())
+    self.mean_gap = self.total_gap / len(self.gaps) if self.gaps else None
+    self.lengths = [len(p) for p in posts]
+    self.mean_length = sum(self.lengths) / float(len(self.lengths)) if posts else None
+    self._posts = posts
+    self._by_date = None
+
+  @property
+  def by_date(self):
+    if self._by_date is None:
+      self._by_date = sorted(self._posts)
+    return self._by_date
+
 class PostList(list):
   def __init__(self, *args, **kwargs):
     list.__init__(self, *args, **kwargs)
@@ -267,16 +787,23 @@ class PostList(list):
       for token in post.token_index:
         self.token_index[token] += post.token_index[token]
 
-class Post(object):
+class PostBase(object):
+  """
+  What a post does, without where it keeps its attributes, like
+  ThreadBase.
+  """
+  __slots__ = ()
+
   def __init__(self, id, title, author, date, text, thread):
+    self.thread = thread
     self.id = unicode(id)
     self.title = title
     self.author = author
     self.date = dt.datetime.fromtimestamp(date)
-    self.text = text
     self.token_index = None
     self.tokenizer = None
-    self.thread = thread
+    self.text = text
+    self._position = None
  
   def __eq__(self, other):
     return self.id == other.id
@@ -295,7 +822,18 @@ class Post(object):
 
   @property
   def position(self):
-    return self.thread.posts.index(self)
+    # The position is recorded when the post is added to its thread, so
+    # we only need to check it is still current.
+    posts = self.thread.posts
+    i = self._position
+    if i is None or i >= len(posts) or posts[i] is not self:
+      self.thread.reindex()
+      i = self._position
+      if i is None or i >= len(posts) or posts[i] is not self:
+        return posts.index(self)
+    # posts.index compares ids, so a post whose id is repeated earlier
+    # in the thread is at the position of the first.
+    return self.thread.first_positions()[self.id]
 
   @property
   def xml(self):
@@ -320,23 +858,127 @@ class Post(object):
 
     b.end('post')
     tag = b.close()
-    # Sanity check to make sure that etree will allow us 
-    # to parse this again later.
-    f = StringIO()
-    etree.ElementTree(tag).write(f)
-    etree.fromstring(f.getvalue())
+    # Make sure that etree will allow us to parse this again later.
+    for value in (self.id, self.title, self.author, self.text):
+      check_xml_chars(value)
     return tag
   
+  def _get_title(self):
+    return self._title
+
+  def _set_title(self, title):
+    self._title = title
+    self.thread.forum._content_hash = None
+
+  title = property(_get_title, _set_title)
+
+  def _get_text(self):
+    return self._text
+
+  def _set_text(self, text):
+    self._text = text
+    self._text_changed()
+
+  def _text_changed(self):
+    """
+    Drop what was worked out from the old text. If the post had been
+    tokenized, the thread and forum token indexes counted its old tokens,
+    so they are dropped too, to be rebuilt by run_tokenizer or
+    Forum.update_tokens.
+    """
+    self.clear_cache()
+    thread = self.thread
+    forum = thread.forum
+    # Post lengths are part of the thread stats.
+    thread._stats = None
+    forum._content_hash = None
+    if self.token_index is not None:
+      self.token_index = None
+      self.tokenizer = None
+      thread.token_index = None
+      forum.token_index = None
+
+  text = property(_get_text, _set_text)
+
   @property
   def sentences(self):
-    return parse_sentences(self.text)
+    # Parsed once, and kept until the text or tokenizer changes.
+    if self._sentences is None:
+      self._sentences = parse_sentences(self.text)
+    return self._sentences
+
+  @property
+  def sentence_stats(self):
+    """
+    Counts derived from the sentences of the post: 'sentence' and 'words',
+    the number of sentences of each type ('question_sentence',
+    'exclaim_sentence', 'period_sentence' and 'other_sentence'), and the
+    lists of 'sentence_lengths' and 'word_lengths'. Cached like sentences.
+    """
+    if self._sentence_stats is None:
+      stats = { 'sentence': 0
+              , 'words': 0
+              , 'question_sentence': 0
+              , 'exclaim_sentence': 0
+              , 'period_sentence': 0
+              , 'other_sentence': 0
+              , 'sentence_lengths': []
+              , 'word_lengths': []
+              }
+      for s in self.sentences:
+        stats['words'] += len(s)
+        stats['sentence'] += 1
+        if s.end == '?':
+          stats['question_sentence'] += 1
+        elif s.end == '!':
+          stats['exclaim_sentence'] += 1
+        elif s.end == '.':
+          stats['period_sentence'] += 1
+        else:
+          stats['other_sentence'] += 1
+        stats['sentence_lengths'].append(len(s))
+        stats['word_lengths'].extend(len(w) for w in s)
+      self._sentence_stats = stats
+    return self._sentence_stats
+
+  def clear_cache(self):
+    """
+    Drop the cached sentences and sentence stats, and the surface counts
+    of wanas.surface_counts, e.g. to free memory once features have been
+    extracted.
+    """
+    self._sentences = None
+    self._sentence_stats = None
+    self._surface_counts = None
 
   def run_tokenizer(self, tokenizer):
+    if tokenizer is not self.tokenizer:
+      self.clear_cache()
     self.tokenizer = tokenizer
     self.token_index = defaultdict(int)
     for token in tokenizer(self.text):
       self.token_index[token] += 1
 
+  def set_token_index(self, tokenizer, counts):
+    """
+    Install token counts computed elsewhere, as run_tokenizer would.
+    """
+    if tokenizer is not self.tokenizer:
+      self.clear_cache()
+    self.tokenizer = tokenizer
+    self.token_index = defaultdict(int, counts)
+
+  def _copy_for(self, thread):
+    """
+    A copy of the post that belongs to thread, see ThreadBase._copy_for.
+    """
+    post = type(self).__new__(type(self))
+    post.__dict__.update(self.__dict__)
+    post.thread = thread
+    post.token_index = None
+    post.tokenizer = None
+    return post
+
   def prev_by_thread(self):
     index = self.position
     if index == 0:
@@ -351,14 +993,18 @@ class Post(object):
     else:
       return self.thread.posts[index + 1]
 
+class Post(PostBase):
+  pass
+
 class Sentence(list):
     """
     Extend the list to store the type of sentence
     Directly from rbp's original code.
     """
 
-    def __init__(self):
-        self.end = ''
+    def __init__(self, words=(), end=''):
+        list.__init__(self, words)
+        self.end = end
 
     def __str__(self):
         return ' '.join(self) + self.end
@@ -367,49 +1013,146 @@ class Sentence(list):
         # set ending character of sentence to store type
         self.end = end
 
+class _Scanner(object):
+  """
+  Regexes that rewrite a text so that it can be split into sentences and
+  words without looking at it character by character, built for the
+  current string.letters (which depends on the locale).
+  """
+  def __init__(self):
+    letters = re.escape(string.letters)
+    alnum = re.escape(string.letters + string.digits)
+    # A '.' followed by a letter is part of a word, for acronyms and URLs.
+    self.dot_letter = re.compile(r'\.(?=[%s])' % letters)
+    # Characters that are neither letters, digits, spaces nor sentence
+    # ends are skipped, without breaking the word they are in.
+    self.junk = re.compile(r'[^%s.\t ?!\n\0]+' % alnum)
+    # Once those are gone, a '.' straight after a digit is part of a word
+    # too, for numbers.
+    self.dot_digit = re.compile(r'(?<=[%s])\.' % re.escape(string.uppercase + string.digits))
+    self.sentence = re.compile(r'([^?!\n.]*)([?!\n.]|\Z)')
+
+  def clean(self, text):
+    """
+    Lowercase text and drop skipped characters, replacing every '.' that
+    belongs to a word with '\0'. What is left is words of letters, digits
+    and '\0' separated by spaces and tabs, and sentence ends.
+    """
+    # Any '\0' already in the text is skipped, but only once the dots
+    # followed by letters have been found.
+    text = self.dot_letter.sub('\0', text.replace('\0', '\1'))
+    text = self.junk.sub('', text).lower()
+    return self.dot_digit.sub('\0', text)
+
+_scanners = {}
+
+def _scanner():
+  key = (string.letters, string.uppercase, string.digits)
+  if key not in _scanners:
+    _scanners[key] = _Scanner()
+  return _scanners[key]
+
+def _sentences(pieces):
+  """
+  Build Sentences from (words, end) pairs, where words is the cleaned text
+  between two sentence ends.
+  """
+  for words, end in pieces:
+    if words:
+      split = words.replace('\0', '.').split()
+      if split:
+        # A word ending in '.' at the end of a line is a statement.
+        if end == '\n' and words[-1] == '\0':
+          end = '.'
+        yield Sentence(split, end)
+
 def parse_sentences(text):
   """
   Extract sentences from posts
   from rbp's original code
   modifications by mlui
   """
-  sentences = []
-  # store current sentence
-  sentence = Sentence()    
-  # store current word
-  word = []                    
-  
-  for i in range(len(text)):
-      char = text[i]
-      if char in string.letters or char in string.digits:
-          word.append(char.lower())
-      else:
-          if char in '\t ' and word:
-              # found word dividor
-              sentence.append(''.join(word))
-              word = []
-          elif char in '?!\n.':
-              # '.' complicated as can be used in acronyms or numbers or URLs
-              if char == '.' and ((word and (word[-1] in string.uppercase or word[-1] in string.digits)) or (i + 1 < len(text) and text[i+1] in string.letters)):
-                  # include '.' for acronym or number
-                  word.append(char)
-              else:
-                  # found end of sentence (and therefore also end of word)
-                  # show type of sentence: question/exclamation/statement
-                  if word:
-                      sentence.append(''.join(word))
-                      if char == '\n' and word[-1] == '.':
-                          char = '.'
-                      word = []
-                  if sentence:
-                      sentence.tag(char)
-                      sentences.append(sentence)
-                      sentence = Sentence()
-  if word != []:
-    sentence.append(''.join(word))
-  if sentence != []:
-    sentences.append(sentence)
-  return sentences
+  scanner = _scanner()
+  return list(_sentences(scanner.sentence.findall(scanner.clean(text))))
+
+def _pieces(chunks):
+  """
+  Regroup a sequence of strings into pieces that end just after a '\n',
+  '?' or '!' (except for the last). None of the cleaning rules look
+  across such a character, so the pieces can be cleaned and split into
+  sentences one at a time.
+  """
+  pending = []
+  for chunk in chunks:
+    cut = max(chunk.rfind('\n'), chunk.rfind('?'), chunk.rfind('!')) + 1
+    if cut == 0:
+      pending.append(chunk)
+      continue
+    pending.append(chunk[:cut])
+    yield ''.join(pending)
+    pending = [chunk[cut:]]
+  if pending:
+    yield ''.join(pending)
+
+def iter_sentences(text, chunksize=65536):
+  """
+  Like parse_sentences, but yields the sentences one at a time, for very
+  long texts. The text is cleaned a piece of about chunksize characters
+  at a time. text can also be an iterable of strings (e.g. a file), read
+  as their concatenation.
+  """
+  if isinstance(text, basestring):
+    chunks = (text[i:i+chunksize] for i in xrange(0, len(text), chunksize))
+  else:
+    chunks = text
+  scanner = _scanner()
+  for piece in _pieces(chunks):
+    for sentence in _sentences(m.groups() for m in scanner.sentence.finditer(scanner.clean(piece))):
+      yield sentence
+
+def add_counts(index, counts):
+  """
+  Add token counts to a token index, either a dict or a
+  vocabulary.TokenIndex, which takes them all in one merge.
+  """
+  from vocabulary import TokenIndex
+  if isinstance(index, TokenIndex):
+    index.add_counts(counts)
+  else:
+    for token, count in counts.iteritems():
+      index[token] += count
+
+def _count_tokens(job):
+  tokenizer, texts = job
+  results = []
+  for text in texts:
+    counts = defaultdict(int)
+    for token in tokenizer(text):
+      counts[token] += 1
+    results.append(dict(counts))
+  return results
+
+def tokenize_posts(posts, tokenizer, workers, chunksize=200):
+  """
+  Tokenize a list of posts with a pool of worker processes. Only the
+  post texts are sent to the workers, in batches of chunksize, and only
+  the token counts come back.
+  """
+  jobs = ( (tokenizer, [p.text for p in posts[i:i+chunksize]])
+           for i in xrange(0, len(posts), chunksize) )
+  pool = multiprocessing.Pool(workers)
+  try:
+    i = 0
+    for batch in pool.imap(_count_tokens, jobs):
+      for counts in batch:
+        posts[i].set_token_index(tokenizer, counts)
+        i += 1
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
 
 def rbp_tokenize(text):
   sentences = parse_sentences(text)
@@ -1,6 +1,33 @@
 import re
+from collections import defaultdict
 from DataModel import rbp_tokenize, PostList
 
+distributions = ["redhat", "rh", "fc" "fedora core", "ubuntu", "debian", "suse", "gentoo", "slackware"]
+beginner_titles = ["noob", "noobie", "newb", "newbie", "n00b", "n00bie"]
+
+emoticon_pattern = re.compile("img src=", re.IGNORECASE)
+version_pattern = re.compile("\d+\.\d?")
+url_pattern = re.compile("(http|www\.)\S+\.\S+")
+
+def tokenize(post):
+  """
+  Tokenize post with rbp_tokenize, unless it already has been. The
+  tokens are the words of post.sentences, so the text is only parsed
+  once for both.
+  """
+  if post.token_index is not None and post.tokenizer is rbp_tokenize:
+    return False
+  if post.tokenizer is not rbp_tokenize:
+    # Changing tokenizer drops the cached sentences, so do it before
+    # they are parsed.
+    post.set_token_index(rbp_tokenize, ())
+  counts = defaultdict(int)
+  for sentence in post.sentences:
+    for word in sentence:
+      counts[word] += 1
+  post.set_token_index(rbp_tokenize, counts)
+  return True
+
 def ADCS_partition_thread(thread):
   initialPost = PostList()
   firstResponse = PostList()
@@ -11,7 +38,7 @@ def ADCS_partition_thread(thread):
   # Adapted from rbp's implementation
   feedback_received = False
 
-  ordered_posts = sorted(thread.posts)
+  ordered_posts = thread.stats.by_date
   #initiator = thread.author
   # We go with rbp's definition instead.
   initiator = ordered_posts[0].author
@@ -67,15 +94,20 @@ sections = [ 'initialPost'
            ]
 
 def ADCS_Thread_features(thread):
-  thread.run_tokenizer(rbp_tokenize)
+  # Only posts that are new, or were tokenized some other way, need to
+  # be tokenized again.
+  tokenized = [tokenize(p) for p in thread.posts]
+  if any(tokenized) or thread.token_index is None or thread.tokenizer is not rbp_tokenize:
+    thread.collect_tokens(rbp_tokenize)
   parts = ADCS_partition_thread(thread)
+  post_features = dict((id(p), ADCS_Post_features(p)) for p in thread.posts)
   features = {}
   
   total_words = 0.0
   total_sentences = 0.0
   total_posts = 0.0
   for part in parts:
-    features[part] = ADCS_PostList_features(parts[part])
+    features[part] = ADCS_PostList_features(parts[part], [post_features[id(p)] for p in parts[part]])
     total_words += features[part]['words']
     total_sentences += features[part]['sentence']
     total_posts += features[part]['posts']
@@ -107,10 +139,15 @@ def ADCS_Thread_features(thread):
       fv[section+'_'+f_name] = section_f[f_name]
   return fv
 
-def ADCS_PostList_features(postlist):
+def ADCS_PostList_features(postlist, post_features=None):
+  """
+  Features of a list of posts. post_features, if given, are the
+  ADCS_Post_features of the posts, already computed.
+  """
   features = {} 
   features['posts'] = len(postlist)
-  post_features = [ ADCS_Post_features(p) for p in postlist ]
+  if post_features is None:
+    post_features = [ ADCS_Post_features(p) for p in postlist ]
 
   for f in additive_features + ['words', 'sentence']:
     features[f] = sum( pf[f] for pf in post_features )
@@ -124,10 +161,9 @@ def ADCS_PostList_features(postlist):
   sentence_lengths = []
   word_lengths = []
   for p in postlist:
-    for s in p.sentences:
-      sentence_lengths.append(len(s))
-      for w in s:
-        word_lengths.append(len(w))
+    stats = p.sentence_stats
+    sentence_lengths.extend(stats['sentence_lengths'])
+    word_lengths.extend(stats['word_lengths'])
 
   try:
     features['avg_sentence'] = sum(sentence_lengths) / float(len(sentence_lengths))
@@ -146,47 +182,30 @@ def ADCS_Post_features(post):
 
   # tokenize if this has not been done yet
   if post.token_index is None:
-    post.run_tokenizer(rbp_tokenize)
+    tokenize(post)
+  token_index = post.token_index
 
   # mention of distribution
-  features['distribution'] = False
-  for word in ["redhat", "rh", "fc" "fedora core", "ubuntu", "debian", "suse", "gentoo", "slackware"]:
-    if word in post.token_index:
-      features['distribution'] = True
+  features['distribution'] = any(word in token_index for word in distributions)
 
   # mention of "beginner title"
-  features['beginner'] = False
-  for word in ["noob", "noobie", "newb", "newbie", "n00b", "n00bie"]:
-    if word in post.token_index:
-      features['beginner'] = True
+  features['beginner'] = any(word in token_index for word in beginner_titles)
 
+  text = post.text
   # emoticon presence
-  features["emoticons"] = re.compile("img src=", re.IGNORECASE).search(post.text) is not None
+  features["emoticons"] = emoticon_pattern.search(text) is not None
   
   # version numbers
-  features["version_numbers"] = re.compile("\d+\.\d?").search(post.text) is not None
+  features["version_numbers"] = version_pattern.search(text) is not None
 
   # urls
-  features["urls"] = re.compile("(http|www\.)\S+\.\S+").search(post.text) is not None
+  features["urls"] = url_pattern.search(text) is not None
 
   # sentence types
-  features["words"] = 0
-  features["sentence"] = 0
-  features["question_sentence"] = 0
-  features["exclaim_sentence"] = 0
-  features["period_sentence"] = 0
-  features["other_sentence"] = 0
-  for s in post.sentences:
-    features["words"] += len(s)
-    features["sentence"] += 1
-    if s.end == '?':
-      features["question_sentence"] += 1
-    elif s.end == '!':
-      features["exclaim_sentence"]  += 1
-    elif s.end == '.':
-      features["period_sentence"]   += 1
-    else:
-      features["other_sentence"]    += 1
+  stats = post.sentence_stats
+  for f in [ "words", "sentence", "question_sentence", "exclaim_sentence"
+           , "period_sentence", "other_sentence" ]:
+    features[f] = stats[f]
 
   return features
       
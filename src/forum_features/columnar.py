@@ -0,0 +1,302 @@
+"""
+Columnar storage backend for forums.
+
+A ColumnarForum keeps the fields of its threads and posts in a ColumnStore:
+array columns for the thread index, author index and timestamp of each
+post, interned author names, and string columns that pack ids, titles and
+text into shared buffers. The ThreadView and PostView objects it hands out
+are __slots__ views over those columns, so the usual attribute API
+(post.author, post.date, post.text, post.thread, ...) keeps working
+while each post costs a handful of machine words instead of a full
+Post with its own __dict__, datetime and strings.
+
+Dates are decoded from the timestamp column on access.
+"""
+from array import array
+import datetime as dt
+
+from DataModel import Forum, ThreadBase, PostBase
+
+class StringColumn(object):
+  """
+  A column of byte or unicode strings packed into a shared buffer.
+  Strings are addressed by (start, end) offsets. Unicode strings are
+  stored utf8-encoded, and flagged so they decode back to unicode.
+  Optionally the first strings of the column live in a read-only base
+  buffer (such as a memory-mapped file); anything appended or replaced
+  afterwards goes into the column's own buffer.
+  """
+  UNICODE = 1
+  LOCAL = 2
+
+  def __init__(self, base=None, start=None, end=None, flags=None):
+    self.base = base
+    self.buf = bytearray()
+    self.start = start if start is not None else array('l')
+    self.end = end if end is not None else array('l')
+    self.flags = flags if flags is not None else array('B')
+
+  def __len__(self):
+    return len(self.flags)
+
+  def __getitem__(self, i):
+    flags = self.flags[i]
+    if flags & self.LOCAL:
+      s = str(buffer(self.buf, self.start[i], self.end[i] - self.start[i]))
+    else:
+      s = self.base[self.start[i]:self.end[i]]
+    if flags & self.UNICODE:
+      s = s.decode('utf8')
+    return s
+
+  def _encode(self, s):
+    if isinstance(s, unicode):
+      return s.encode('utf8'), self.UNICODE | self.LOCAL
+    return s, self.LOCAL
+
+  def __setitem__(self, i, s):
+    s, flags = self._encode(s)
+    self.start[i] = len(self.buf)
+    self.buf.extend(s)
+    self.end[i] = len(self.buf)
+    self.flags[i] = flags
+
+  def append(self, s):
+    s, flags = self._encode(s)
+    self.start.append(len(self.buf))
+    self.buf.extend(s)
+    self.end.append(len(self.buf))
+    self.flags.append(flags)
+    return len(self.flags) - 1
+
+class ColumnStore(object):
+  """
+  The columns behind a ColumnarForum. Thread and post fields are stored
+  by index; author names are interned once in self.authors and referred
+  to by position.
+  """
+  def __init__(self):
+    self.authors = []
+    self.author_index = {}
+
+    self.thread_id = StringColumn()
+    self.thread_title = StringColumn()
+    self.thread_author = array('l')
+    self.thread_timestamp = array('d')
+
+    self.post_id = StringColumn()
+    self.post_title = StringColumn()
+    self.post_text = StringColumn()
+    self.post_thread = array('l')
+    self.post_author = array('l')
+    self.post_timestamp = array('d')
+
+  def encode_date(self, timestamp):
+    return timestamp
+
+  def decode_date(self, value):
+    return dt.datetime.fromtimestamp(value)
+
+  def intern(self, author):
+    try:
+      return self.author_index[author]
+    except KeyError:
+      self.author_index[author] = len(self.authors)
+      self.authors.append(author)
+      return len(self.authors) - 1
+
+  def add_thread(self, id, title, author, date):
+    self.thread_id.append(id)
+    self.thread_title.append(title)
+    self.thread_author.append(self.intern(author))
+    self.thread_timestamp.append(self.encode_date(date))
+    return len(self.thread_author) - 1
+
+  def add_post(self, thread, id, title, author, date, text):
+    self.post_id.append(id)
+    self.post_title.append(title)
+    self.post_text.append(text)
+    self.post_thread.append(thread)
+    self.post_author.append(self.intern(author))
+    self.post_timestamp.append(self.encode_date(date))
+    return len(self.post_author) - 1
+
+  def numpy_column(self, name):
+    """
+    A numpy view (no copy) of one of the array columns, e.g.
+    store.numpy_column('post_author').
+    """
+    import numpy
+    column = getattr(self, name)
+    return numpy.frombuffer(column, dtype=numpy.dtype(column.typecode))
+
+class ThreadView(ThreadBase):
+  """
+  Thread backed by a ColumnStore.
+  """
+  __slots__ = ( '_store', '_i', 'forum', 'posts', '_post_dict', 'post_authors'
+              , 'token_index', 'tokenizer', 'new_posts', 'dirty', '_stats'
+              , '_positions'
+              )
+
+  def __init__(self, id, title, author, date, forum):
+    store = forum.store
+    self._bind(store, store.add_thread(unicode(id), title, author, date), forum)
+
+  @classmethod
+  def view(cls, store, i, forum):
+    """
+    Build a view over a thread that is already in the store.
+    """
+    thread = cls.__new__(cls)
+    thread._bind(store, i, forum)
+    return thread
+
+  def _bind(self, store, i, forum):
+    self._store = store
+    self._i = i
+    self.forum = forum
+    self.posts = []
+    self._post_dict = None
+    self.post_authors = set()
+    self.token_index = None
+    self.tokenizer = None
+    self.new_posts = []
+    self.dirty = False
+    self._stats = None
+    self._positions = None
+
+  @property
+  def id(self):
+    return self._store.thread_id[self._i]
+
+  @property
+  def title(self):
+    return self._store.thread_title[self._i]
+
+  @property
+  def author(self):
+    return self._store.authors[self._store.thread_author[self._i]]
+
+  @property
+  def date(self):
+    return self._store.decode_date(self._store.thread_timestamp[self._i])
+
+  @property
+  def post_dict(self):
+    # Only built if someone asks for it.
+    if self._post_dict is None:
+      self._post_dict = dict((p.id, p) for p in self.posts)
+    return self._post_dict
+
+  def add_Post(self, id, title, author, date, text):
+    post = PostView(id, title, author, date, text, self)
+    self._add_view(post)
+    return post
+
+  def _copy_for(self, forum):
+    thread = ThreadView.view(self._store, self._i, forum)
+    for post in self.posts:
+      thread._add_view(post._copy_for(thread))
+    return thread
+
+  def _add_view(self, post):
+    post._position = len(self.posts)
+    self.posts.append(post)
+    if self._post_dict is not None:
+      self._post_dict[post.id] = post
+    self.post_authors.add(post.author)
+    self._stats = None
+    if self._positions is not None:
+      self._positions.setdefault(post.id, post._position)
+
+class PostView(PostBase):
+  """
+  Post backed by a ColumnStore. The copies made for a sampling.ForumView
+  share the store with the parent's posts, so their title and text cannot
+  be set: the parent's post would not know its text had changed.
+  """
+  __slots__ = ( '_store', '_i', 'thread', '_position', 'token_index', 'tokenizer'
+              , '_sentences', '_sentence_stats', '_surface_counts', '_shared'
+              )
+
+  def __init__(self, id, title, author, date, text, thread):
+    store = thread._store
+    i = store.add_post(thread._i, unicode(id), title, author, date, text)
+    self._bind(store, i, thread)
+
+  @classmethod
+  def view(cls, store, i, thread):
+    """
+    Build a view over a post that is already in the store.
+    """
+    post = cls.__new__(cls)
+    post._bind(store, i, thread)
+    return post
+
+  def _copy_for(self, thread):
+    post = PostView.view(self._store, self._i, thread)
+    post._sentences = self._sentences
+    post._sentence_stats = self._sentence_stats
+    post._surface_counts = self._surface_counts
+    post._shared = True
+    return post
+
+  def _bind(self, store, i, thread):
+    self._store = store
+    self._i = i
+    self.thread = thread
+    self._position = None
+    self.token_index = None
+    self.tokenizer = None
+    self._sentences = None
+    self._sentence_stats = None
+    self._surface_counts = None
+    self._shared = False
+
+  def _check_writable(self):
+    if self._shared:
+      raise TypeError, "Cannot change a post through a ForumView of a columnar forum"
+
+  @property
+  def id(self):
+    return self._store.post_id[self._i]
+
+  def _get_title(self):
+    return self._store.post_title[self._i]
+
+  def _set_title(self, title):
+    self._check_writable()
+    self._store.post_title[self._i] = title
+    self.thread.forum._content_hash = None
+
+  title = property(_get_title, _set_title)
+
+  @property
+  def author(self):
+    return self._store.authors[self._store.post_author[self._i]]
+
+  @property
+  def date(self):
+    return self._store.decode_date(self._store.post_timestamp[self._i])
+
+  def _get_text(self):
+    return self._store.post_text[self._i]
+
+  def _set_text(self, text):
+    self._check_writable()
+    self._store.post_text[self._i] = text
+    self._text_changed()
+
+  text = property(_get_text, _set_text)
+
+class ColumnarForum(Forum):
+  """
+  Forum whose threads and posts are views over a ColumnStore.
+  """
+  def __init__(self, title, store=None):
+    Forum.__init__(self, title)
+    self.store = store if store is not None else ColumnStore()
+
+  def new_Thread(self, thread_id, title, author, date):
+    return ThreadView(thread_id, title, author, date, self)
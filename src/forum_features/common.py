@@ -1,38 +1,113 @@
 import math
+import multiprocessing
+from collections import defaultdict
+import vocabulary
 from HTMLParser import HTMLParser, HTMLParseError
 from htmlentitydefs import entitydefs
 
 class CleanPost(HTMLParser):
+  """
+  Strips the HTML from a post, line by line: images become '<IMAGE>',
+  entities their character (or '<ENTITY>' if unknown), other markup is
+  dropped, and lines the parser chokes on are kept as they are. A line
+  consisting of '<br />' is dropped altogether. The cleaned text is
+  collected in a list of pieces and joined once, and lines that contain
+  no markup while the parser is between tags skip the parser entirely.
+  """
   # TODO: Don't swallow images
   def reset(self):
     HTMLParser.reset(self)
     self.text = ''
+    self.buffer = []
 
   def __call__(self,data):
     self.reset()
     for l in data.split('\n'):
-      l = l.strip()
-      if l != '<br />':
-        try:
-          self.feed(l)
-          self.text += '\n'
-        except HTMLParseError:
-          self.text += l + '\n'
+      self.feed_line(l)
+    self.text = ''.join(self.buffer)
+    self.buffer = []
     return self.text
+
+  def feed_line(self, l):
+    l = l.strip()
+    if l != '<br />':
+      if '<' not in l and '&' not in l and not self.rawdata and self.cdata_elem is None:
+        # All the parser would do is pass the line to handle_data.
+        self.buffer.append(l)
+        self.buffer.append('\n')
+        return
+      try:
+        self.feed(l)
+        self.buffer.append('\n')
+      except HTMLParseError:
+        self.buffer.append(l)
+        self.buffer.append('\n')
+
+  def iter_clean(self, chunks):
+    """
+    Clean a post that arrives in pieces (e.g. a file, or the parts of a
+    huge string), yielding the cleaned text of each line as soon as the
+    line is complete. The pieces are joined as if they were one string,
+    so ''.join(cleaner.iter_clean(chunks)) == cleaner(''.join(chunks)).
+    """
+    self.reset()
+    # The pieces of the current, incomplete line.
+    pending = []
+    for chunk in chunks:
+      pending.append(chunk)
+      if '\n' not in chunk:
+        continue
+      lines = ''.join(pending).split('\n')
+      pending = [lines.pop()]
+      for l in lines:
+        self.feed_line(l)
+        if self.buffer:
+          yield ''.join(self.buffer)
+          self.buffer = []
+    self.feed_line(''.join(pending))
+    if self.buffer:
+      yield ''.join(self.buffer)
+      self.buffer = []
         
   def handle_data(self, data):
-    self.text += data 
+    self.buffer.append(data)
 
   def handle_entityref(self, name):
     try:
-      self.text += entitydefs[name]
+      self.buffer.append(entitydefs[name])
     except KeyError:
-      self.text += '<ENTITY>'
+      self.buffer.append('<ENTITY>')
 
   def handle_starttag(self, tag, attrs):
     if tag == 'img':
-      self.text += '<IMAGE>'
-    
+      self.buffer.append('<IMAGE>')
+
+def _clean_batch(texts):
+  clean = CleanPost()
+  return [clean(t) for t in texts]
+
+def clean_posts(texts, workers=None, chunksize=100):
+  """
+  Clean a list of post texts with CleanPost, returning the cleaned texts
+  in order. With workers > 1 the texts are sent to a pool of that many
+  processes, chunksize at a time.
+  """
+  texts = list(texts)
+  if workers is None or workers <= 1:
+    return _clean_batch(texts)
+  batches = (texts[i:i+chunksize] for i in xrange(0, len(texts), chunksize))
+  pool = multiprocessing.Pool(workers)
+  try:
+    results = []
+    for batch in pool.imap(_clean_batch, batches):
+      results.extend(batch)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  return results
 
 def check_tokenized(e):
   if e.token_index is None:
@@ -55,6 +130,8 @@ def overlap(child, parent):
   """
   Overlap as defined by wanas et al
   """
+  if vocabulary.compatible(child, parent):
+    return overlap_ids(child, parent)
   common = 0
   for k in child:
     if k in parent:
@@ -69,6 +146,8 @@ def cosine_similarity(d1, d2):
   """
   The vector space model stalwart, Cosine Similarity
   """
+  if vocabulary.compatible(d1, d2):
+    return cosine_similarity_ids(d1, d2)
   w = math.sqrt(sum(t * t for t in d1.values())) * math.sqrt(sum(t * t for t in d2.values()))
   if w == 0.0:
     return 0
@@ -78,6 +157,24 @@ def cosine_similarity(d1, d2):
     if t in d2:
       acc += d1[t] + d2[t]
   return acc / w
+
+# The same metrics for TokenIndexes over a shared Vocabulary, merging
+# their sorted id arrays. Counts are integers, so the sums come out the
+# same whatever order they are added in.
+def overlap_ids(child, parent):
+  total = child.counts.sum()
+  if total == 0:
+    return 0.0
+  common = child.counts[vocabulary.shared(child.ids, parent.ids)].sum()
+  return float(common) / total.item()
+
+def cosine_similarity_ids(d1, d2):
+  w = math.sqrt((d1.counts * d1.counts).sum()) * math.sqrt((d2.counts * d2.counts).sum())
+  if w == 0.0:
+    return 0
+  acc = float( d1.counts[vocabulary.shared(d1.ids, d2.ids)].sum()
+             + d2.counts[vocabulary.shared(d2.ids, d1.ids)].sum() )
+  return acc / w
       
 def mean(seq):
   seq = list(seq)
@@ -85,10 +182,16 @@ def mean(seq):
 
 import numpy
 def feature_mean(featurelist):
-  all_keys = reduce(set.union,featurelist, set())
+  # Sum each key over the dicts that have it, in one pass.
+  sums = {}
+  counts = defaultdict(int)
+  for f in featurelist:
+    for key in f:
+      sums[key] = sums.get(key, 0) + f[key]
+      counts[key] += 1
   agg = {}
-  for key in all_keys:
-    agg[key] = mean(f[key] for f in featurelist if key in f)
+  for key in sums:
+    agg[key] = sums[key] / float(counts[key])
   return agg
 
 class ThreadSingleuserFeatures:
@@ -122,13 +225,20 @@ class UserPostAggregate:
     fv = self.aggregator(f)
     return fv
 
-def user_post_aggregate(forum, feature_extractor, aggregator=feature_mean, users=None):
+def user_post_aggregate(forum, feature_extractor, aggregator=feature_mean, users=None, clear_cache=False):
+  """
+  With clear_cache, the sentences each post caches during extraction are
+  dropped once its user is done, to keep memory down on large forums.
+  """
   if users is None: users = [ a for a in forum.authors ]
   features = {}
   for user in users:
     A = forum.authors[user]
     f = [ feature_extractor(p) for p in A.posts ]
     features[user] = aggregator(f)
+    if clear_cache:
+      for p in A.posts:
+        p.clear_cache()
   return features
 
 class ThreadPostFeatures:
@@ -0,0 +1,225 @@
+"""
+Batch feature extraction into numpy matrices.
+
+Runs a list of post feature extractors (functions from a post to a dict
+of features, e.g. wanas.wanas_Post_features, adcs.ADCS_Post_features,
+conll2010.StructuralFeatures) over many posts at once. The results go
+into a FeatureMatrix: a dense float matrix with one row per post and one
+column per feature name, and a mask recording which features each post
+actually had. Aggregating the rows by author or thread is then a
+vectorized reduction instead of a feature_mean over lists of dicts.
+
+extract_features runs a thread-level extractor over every thread of a
+forum, optionally in a pool of worker processes.
+"""
+import logging
+import multiprocessing
+from collections import defaultdict
+
+import numpy
+
+from DataModel import Forum
+
+logger = logging.getLogger('extraction')
+
+class FeatureMatrix(object):
+  """
+  Features of a list of items (rows) by feature name (columns). X holds
+  the values and mask is True where an extractor produced a value;
+  missing values are 0 in X.
+  """
+  def __init__(self, rows, names, X, mask):
+    self.rows = rows
+    self.names = names
+    self.index = dict((n, i) for i, n in enumerate(names))
+    self.X = X
+    self.mask = mask
+
+  def __len__(self):
+    return len(self.rows)
+
+  def __repr__(self):
+    return "<FeatureMatrix %d rows x %d features>" % self.X.shape
+
+  def column(self, name):
+    return self.X[:, self.index[name]]
+
+  def to_dicts(self):
+    """
+    The rows as feature dicts, as the extractors would have returned them.
+    """
+    return [ dict((n, self.X[i, j].item()) for j, n in enumerate(self.names) if self.mask[i, j])
+             for i in xrange(len(self.rows)) ]
+
+  def group_mean(self, key):
+    """
+    Mean of each feature over groups of rows, where the group of a row
+    is key(row). Like common.feature_mean, each mean is taken over the
+    rows of the group that have the feature. Returns a FeatureMatrix
+    with one row per group key, in order of first appearance; features
+    no row of a group has are masked out.
+    """
+    keys = [key(r) for r in self.rows]
+    groups = []
+    codes = {}
+    for k in keys:
+      if k not in codes:
+        codes[k] = len(groups)
+        groups.append(k)
+    code = numpy.array([codes[k] for k in keys], dtype=numpy.int64)
+    if len(groups) == 0:
+      return FeatureMatrix([], self.names, self.X[:0], self.mask[:0])
+
+    # Sum the rows of each group with one reduceat over the rows sorted
+    # by group.
+    order = numpy.argsort(code, kind='mergesort')
+    starts = numpy.searchsorted(code[order], numpy.arange(len(groups)))
+    sums = numpy.add.reduceat(numpy.where(self.mask, self.X, 0.0)[order], starts, axis=0)
+    counts = numpy.add.reduceat(self.mask[order].astype(numpy.int64), starts, axis=0)
+    mask = counts > 0
+    means = numpy.zeros(sums.shape)
+    means[mask] = sums[mask] / counts[mask]
+    return FeatureMatrix(groups, self.names, means, mask)
+
+  def mean_by_author(self):
+    return self.group_mean(lambda post: post.author)
+
+  def mean_by_thread(self):
+    return self.group_mean(lambda post: post.thread.id)
+
+def extract_matrix(items, extractors, names=None):
+  """
+  Apply each extractor to each item, collecting the features into a
+  FeatureMatrix. The columns are the given feature names, in order
+  (other features are dropped), or by default every feature name any
+  extractor produced, sorted. Boolean features become 0.0 and 1.0.
+  With names given, each item's features go straight into the matrix
+  instead of being kept until every item has been seen.
+  """
+  items = list(items)
+  def extract(item):
+    features = {}
+    for extractor in extractors:
+      features.update(extractor(item))
+    return features
+
+  if names is None:
+    results = [extract(item) for item in items]
+    names = sorted(reduce(set.union, results, set()))
+  else:
+    results = (extract(item) for item in items)
+  index = dict((n, i) for i, n in enumerate(names))
+  X = numpy.zeros((len(items), len(names)))
+  mask = numpy.zeros((len(items), len(names)), dtype=bool)
+  for i, features in enumerate(results):
+    for name, value in features.iteritems():
+      j = index.get(name)
+      if j is not None:
+        X[i, j] = value
+        mask[i, j] = True
+  return FeatureMatrix(items, names, X, mask)
+
+def forum_feature_matrix(forum, extractors, names=None):
+  """
+  extract_matrix over every post of a forum, thread by thread.
+  """
+  return extract_matrix((p for t in forum.threads for p in t.posts), extractors, names)
+
+#####
+# Thread-level extraction
+#####
+class ThreadPosts(object):
+  """
+  Turns a post feature extractor into a thread extractor, returning the
+  list of the features of the thread's posts. For use with
+  extract_features, e.g. ThreadPosts(wanas.wanas_Post_features).
+  """
+  def __init__(self, extractor):
+    self.extractor = extractor
+
+  def __call__(self, thread):
+    return [ self.extractor(p) for p in thread.posts ]
+
+def detach(thread):
+  """
+  A copy of thread, with its posts, in a Forum of its own: all a thread
+  extractor needs, without the rest of the forum it would otherwise drag
+  along when pickled. Token indexes are copied (as dicts) if the thread
+  has been tokenized.
+  """
+  forum = Forum(thread.forum.title)
+  forum.add_Thread(thread.id, thread.title, thread.author, 0)
+  copy = forum.threads[0]
+  copy.date = thread.date
+  for p in thread.posts:
+    forum.add_Post(thread.id, p.id, p.title, p.author, 0, p.text)
+    forum.posts[-1].date = p.date
+
+  if thread.token_index is not None:
+    for p, q in zip(thread.posts, copy.posts):
+      if p.token_index is not None:
+        q.tokenizer = p.tokenizer
+        q.token_index = defaultdict(int, p.token_index.iteritems())
+    copy.tokenizer = thread.tokenizer
+    copy.token_index = defaultdict(int, thread.token_index.iteritems())
+    # The forum index only covers this thread.
+    forum.tokenizer = thread.tokenizer
+    forum.token_index = defaultdict(int, copy.token_index)
+  return forum
+
+_extractor = None
+
+def _init_worker(extractor):
+  global _extractor
+  _extractor = extractor
+
+def _extract_detached(forum):
+  return _extractor(forum.threads[0])
+
+def log_progress(done, total):
+  """
+  A progress callback for extract_features that logs every 10%.
+  """
+  if done == total or done % max(1, total // 10) == 0:
+    logger.info("Extracted features of %d/%d threads", done, total)
+
+def extract_features(forum, extractor, workers=None, chunksize=20, progress=None):
+  """
+  Apply a thread feature extractor (e.g. adcs.ADCS_Thread_features, or
+  ThreadPosts(wanas.wanas_Post_features)) to every thread of forum,
+  returning the results in thread order.
+
+  With workers > 1 the threads are spread over a pool of that many
+  processes, chunksize threads at a time. Each thread is sent as a
+  detached copy (see detach), so the extractor must be picklable and
+  only look at the thread it is given. Otherwise the threads are
+  processed one by one in this process. progress, if given, is called as
+  progress(done, total) after each thread.
+  """
+  return extract_threads(forum.threads, extractor, workers, chunksize, progress)
+
+def extract_threads(threads, extractor, workers=None, chunksize=20, progress=None):
+  """
+  extract_features over a list of threads.
+  """
+  total = len(threads)
+  results = []
+  if workers is not None and workers > 1:
+    pool = multiprocessing.Pool(workers, _init_worker, (extractor,))
+    try:
+      for result in pool.imap(_extract_detached, (detach(t) for t in threads), chunksize):
+        results.append(result)
+        if progress is not None:
+          progress(len(results), total)
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+  else:
+    for thread in threads:
+      results.append(extractor(thread))
+      if progress is not None:
+        progress(len(results), total)
+  return results
@@ -0,0 +1,148 @@
+"""
+Persistent cache of thread features.
+
+Feature vectors are stored in a sqlite database, keyed by the name and
+version of the extractor and the content hash of the thread
+(Thread.content_hash), so a thread whose posts have not changed since
+the last run gets its features back from the cache instead of having
+them recomputed. Bump the version of an extractor whenever a change to
+it would give different features.
+
+  cache = FeatureCache('features.db', max_entries=100000)
+  features = cache.extract(forum, adcs.ADCS_Thread_features)
+  print cache.report()
+"""
+import sqlite3
+import time
+import cPickle
+
+from extraction import extract_threads, ThreadPosts
+
+# Stay below sqlite's limit on the number of parameters in a query.
+BATCH = 500
+
+def extractor_name(extractor):
+  """
+  The name an extractor's features are stored under.
+  """
+  if isinstance(extractor, ThreadPosts):
+    return 'ThreadPosts(%s)' % extractor_name(extractor.extractor)
+  name = getattr(extractor, '__name__', type(extractor).__name__)
+  return '%s.%s' % (extractor.__module__, name)
+
+class FeatureCache(object):
+  """
+  A feature cache in the sqlite database at path. With max_entries or
+  max_bytes, the least recently used entries are evicted whenever new
+  ones take the cache over either limit.
+  """
+  def __init__(self, path, max_entries=None, max_bytes=None):
+    self.path = path
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.db = sqlite3.connect(path)
+    self.db.text_factory = str
+    with self.db:
+      self.db.execute( "CREATE TABLE IF NOT EXISTS features "
+                       "( extractor TEXT, version TEXT, hash TEXT, value BLOB"
+                       ", size INTEGER, last_used REAL"
+                       ", PRIMARY KEY (extractor, version, hash) )"
+                     )
+      self.db.execute("CREATE INDEX IF NOT EXISTS features_lru ON features (last_used)")
+
+  def close(self):
+    self.db.close()
+
+  def __len__(self):
+    return self.db.execute("SELECT count(*) FROM features").fetchone()[0]
+
+  def get_many(self, extractor, version, hashes):
+    """
+    The cached features of each of the given content hashes, as a dict
+    from hash to features; hashes that are not cached are left out.
+    """
+    hashes = list(set(hashes))
+    found = {}
+    for i in xrange(0, len(hashes), BATCH):
+      batch = hashes[i:i+BATCH]
+      rows = self.db.execute( "SELECT hash, value FROM features WHERE extractor = ? AND version = ? "
+                              "AND hash IN (%s)" % ','.join('?' * len(batch))
+                            , [extractor, str(version)] + batch
+                            )
+      for h, value in rows:
+        found[h] = cPickle.loads(str(value))
+    if found:
+      now = time.time()
+      with self.db:
+        self.db.executemany( "UPDATE features SET last_used = ? WHERE extractor = ? AND version = ? AND hash = ?"
+                           , [(now, extractor, str(version), h) for h in found]
+                           )
+    return found
+
+  def put_many(self, extractor, version, items):
+    """
+    Store features given as (hash, features) pairs, in one transaction.
+    """
+    now = time.time()
+    rows = []
+    for h, features in items:
+      value = cPickle.dumps(features, cPickle.HIGHEST_PROTOCOL)
+      rows.append((extractor, str(version), h, sqlite3.Binary(value), len(value), now))
+    with self.db:
+      self.db.executemany("INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?)", rows)
+    self.evict()
+
+  def evict(self):
+    """
+    Drop least recently used entries until the cache is within its limits.
+    """
+    with self.db:
+      if self.max_entries is not None:
+        excess = len(self) - self.max_entries
+        if excess > 0:
+          self.db.execute( "DELETE FROM features WHERE rowid IN "
+                           "(SELECT rowid FROM features ORDER BY last_used LIMIT ?)", (excess,))
+      if self.max_bytes is not None:
+        total = self.db.execute("SELECT coalesce(sum(size), 0) FROM features").fetchone()[0]
+        if total > self.max_bytes:
+          doomed = []
+          for rowid, size in self.db.execute("SELECT rowid, size FROM features ORDER BY last_used"):
+            if total <= self.max_bytes:
+              break
+            doomed.append((rowid,))
+            total -= size
+          self.db.executemany("DELETE FROM features WHERE rowid = ?", doomed)
+
+  def extract(self, forum, extractor, version=None, workers=None, progress=None):
+    """
+    Like extraction.extract_features: the features of every thread of the
+    forum, in thread order. Cached features are looked up in bulk, and
+    only the threads without them are passed to the extractor, whose
+    results are then added to the cache. version defaults to the
+    extractor's version attribute, if it has one.
+    """
+    name = extractor_name(extractor)
+    if version is None:
+      version = getattr(extractor, 'version', '')
+    hashes = [t.content_hash for t in forum.threads]
+    cached = self.get_many(name, version, hashes)
+
+    missing = [i for i, h in enumerate(hashes) if h not in cached]
+    self.hits += len(hashes) - len(missing)
+    self.misses += len(missing)
+    computed = extract_threads([forum.threads[i] for i in missing], extractor, workers, progress=progress)
+    new = dict((hashes[i], features) for i, features in zip(missing, computed))
+    self.put_many(name, version, new.iteritems())
+    cached.update(new)
+    return [cached[h] for h in hashes]
+
+  def hit_rate(self):
+    lookups = self.hits + self.misses
+    return self.hits / float(lookups) if lookups else 0.0
+
+  def report(self):
+    return "%d hits, %d misses (%.1f%% hit rate), %d entries cached" % ( self.hits, self.misses
+                                                                      , 100 * self.hit_rate(), len(self)
+                                                                      )
@@ -0,0 +1,75 @@
+"""
+MinHash signatures and locality-sensitive hashing over token indexes.
+
+Used to find candidate pairs of similar documents (e.g. near-duplicate
+threads) in roughly linear time, rather than comparing every pair. Each
+document's set of tokens gets a MinHash signature of bands * rows values;
+documents whose signatures agree on all the rows of at least one band
+become candidates. Two documents with Jaccard similarity s end up as
+candidates with probability 1 - (1 - s**rows)**bands, so more bands
+raise recall and more rows raise precision (and speed). The probability
+is about one half at s = (1 / bands) ** (1 / rows), which should lie a
+little below the similarity one is looking for.
+"""
+import zlib
+from collections import defaultdict
+from itertools import combinations
+
+import numpy
+
+# Hash values are computed modulo a Mersenne prime small enough that the
+# arithmetic stays within int64.
+PRIME = (1 << 31) - 1
+
+def token_hashes(tokens):
+  """
+  Stable 31-bit hashes of a set of tokens.
+  """
+  hashes = set()
+  for t in tokens:
+    if isinstance(t, unicode):
+      t = t.encode('utf8')
+    hashes.add((zlib.crc32(t) & 0xffffffff) % PRIME)
+  return numpy.fromiter(hashes, dtype=numpy.int64, count=len(hashes))
+
+class MinHasher(object):
+  """
+  Computes MinHash signatures of num_perm values, using random affine
+  permutations (a*x + b) mod PRIME of the token hashes.
+  """
+  def __init__(self, num_perm, seed=0):
+    rng = numpy.random.RandomState(seed)
+    self.num_perm = num_perm
+    self.a = rng.randint(1, PRIME, size=num_perm).astype(numpy.int64)
+    self.b = rng.randint(0, PRIME, size=num_perm).astype(numpy.int64)
+
+  def signature(self, tokens):
+    """
+    The signature of a collection of tokens, or None if it is empty.
+    """
+    x = token_hashes(tokens)
+    if len(x) == 0:
+      return None
+    return ((numpy.outer(x, self.a) + self.b) % PRIME).min(axis=0)
+
+def candidate_pairs(token_indexes, bands=40, rows=3, seed=0):
+  """
+  Pairs (i, j), i < j, of token indexes whose MinHash signatures collide
+  in at least one LSH band. Empty token indexes are never candidates.
+  """
+  hasher = MinHasher(bands * rows, seed)
+  signatures = []
+  for i, index in enumerate(token_indexes):
+    signature = hasher.signature(t for t in index if index[t])
+    if signature is not None:
+      signatures.append((i, signature))
+
+  pairs = set()
+  for band in xrange(bands):
+    buckets = defaultdict(list)
+    lo, hi = band * rows, (band + 1) * rows
+    for i, signature in signatures:
+      buckets[signature[lo:hi].tostring()].append(i)
+    for members in buckets.itervalues():
+      pairs.update(combinations(members, 2))
+  return pairs
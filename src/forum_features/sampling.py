@@ -0,0 +1,145 @@
+"""
+Subforums and thread samples.
+
+A ForumView is a read-only Forum over some of the threads of another
+forum, for samples, filters and train/test splits (see Forum.sample_view,
+Forum.filter and Forum.split). It holds shallow copies of the parent's
+threads and posts, which share their field values and cached sentences
+rather than re-adding every post as Forum.sample does. The copies belong
+to the view: thread.forum and post.thread lead to the view and its
+authors, and tokenizing the view tokenizes its own copies only. Post
+text set through a view is not seen by the parent. The posts of views
+of a columnar forum read their fields from the parent's store, so their
+title and text cannot be set at all.
+
+reservoir_sample and stratified_sample draw threads from a stream, such
+as DataModel.iter_xml, holding only the sample in memory. The sampled
+threads can then be gathered into one forum with Forum.attach_Thread,
+as load_sample does.
+"""
+import random
+from collections import defaultdict
+
+from DataModel import Forum, iter_xml
+
+class ForumView(Forum):
+  """
+  A Forum over copies of a list of threads of parent. Threads and posts
+  cannot be added to a view, as they would not be added to the parent.
+  """
+  def __init__(self, parent, threads, title=None):
+    Forum.__init__(self, parent.title if title is None else title)
+    self.parent = parent
+    self.vocabulary = parent.vocabulary
+    for thread in threads:
+      thread = thread._copy_for(self)
+      self.threads.append(thread)
+      self.thread_dict[thread.id] = thread
+      self.authors[thread.author].add_Thread(thread)
+      for post in thread.posts:
+        self.authors[post.author].add_Post(post)
+        self.posts.append(post)
+        self.post_dict[post.id] = post
+
+  def add_Thread(self, thread_id, title, author, date):
+    raise TypeError, "Cannot add threads to a ForumView"
+
+  def add_Post(self, thread_id, post_id, title, author, date, text):
+    raise TypeError, "Cannot add posts to a ForumView"
+
+  def attach_Thread(self, thread):
+    raise TypeError, "Cannot add threads to a ForumView"
+
+def sample(forum, k, seed=None):
+  """
+  A view of k threads of forum drawn at random, the same threads (in the
+  same order) as forum.sample(k, seed).
+  """
+  assert k <= len(forum.threads), "Not enough threads to sample"
+  rng = random.Random(seed)
+  title = forum.title+'_(k:%d,seed:%s)'%(k,str(seed))
+  return ForumView(forum, rng.sample(forum.threads, k), title)
+
+def split(forum, fraction, seed=None):
+  """
+  Split the threads of forum at random into two views, the first with
+  round(fraction * len(forum.threads)) threads and the second with the
+  rest. Each view keeps the threads in forum order.
+  """
+  assert 0 <= fraction <= 1, "fraction must be between 0 and 1"
+  order = range(len(forum.threads))
+  random.Random(seed).shuffle(order)
+  first = set(order[:int(round(fraction * len(order)))])
+  threads = forum.threads
+  return ( ForumView(forum, [t for i, t in enumerate(threads) if i in first])
+         , ForumView(forum, [t for i, t in enumerate(threads) if i not in first])
+         )
+
+#####
+# Streaming samplers
+#####
+def reservoir_sample(threads, k, seed=None):
+  """
+  k threads drawn uniformly at random from an iterable of threads, e.g.
+  iter_xml(file), in one pass and holding at most k threads at a time.
+  Returns the sample in stream order (fewer than k threads if the
+  stream is shorter).
+  """
+  rng = random.Random(seed)
+  reservoir = []
+  for i, thread in enumerate(threads):
+    if i < k:
+      reservoir.append((i, thread))
+    else:
+      j = rng.randint(0, i)
+      if j < k:
+        reservoir[j] = (i, thread)
+  reservoir.sort()
+  return [thread for i, thread in reservoir]
+
+def stratified_sample(threads, key, k, seed=None):
+  """
+  Up to k threads drawn uniformly at random from each stratum of an
+  iterable of threads, where the stratum of a thread is key(thread)
+  (e.g. its author, or its number of posts). Like reservoir_sample,
+  one pass holding only the sample. Returns a dict from stratum to its
+  sample, in stream order.
+  """
+  rng = random.Random(seed)
+  seen = defaultdict(int)
+  reservoirs = defaultdict(list)
+  for i, thread in enumerate(threads):
+    stratum = key(thread)
+    n = seen[stratum]
+    seen[stratum] += 1
+    if n < k:
+      reservoirs[stratum].append((i, thread))
+    else:
+      j = rng.randint(0, n)
+      if j < k:
+        reservoirs[stratum][j] = (i, thread)
+  result = {}
+  for stratum, reservoir in reservoirs.iteritems():
+    reservoir.sort()
+    result[stratum] = [thread for i, thread in reservoir]
+  return result
+
+def load_sample(file, k, seed=None, key=None):
+  """
+  Load a random sample of the threads of a forum xml file without
+  loading the whole forum: k threads with reservoir_sample, or with
+  key given, k threads per stratum with stratified_sample. Returns a
+  Forum holding the sampled threads, in file order.
+  """
+  if key is None:
+    sampled = reservoir_sample(iter_xml(file), k, seed)
+  else:
+    # Sample (position, thread) pairs, to put the strata back in file
+    # order.
+    strata = stratified_sample(enumerate(iter_xml(file)), lambda (i, t): key(t), k, seed)
+    sampled = [t for i, t in sorted(p for s in strata.itervalues() for p in s)]
+  # Each thread comes in a Forum of its own with the file's title.
+  forum = Forum(sampled[0].forum.title if sampled else None)
+  for thread in sampled:
+    forum.attach_Thread(thread)
+  return forum
@@ -0,0 +1,120 @@
+"""
+Vectorized similarity search over token indexes.
+
+Documents (e.g. threads) are packed into a sparse CSR document x term
+matrix and compared with blocked sparse matrix products, instead of
+calling a similarity function on every pair of dicts. Blocks of rows are
+sized so that each product fits in a given memory budget.
+
+Requires scipy; use available() to check before calling into this module.
+"""
+import numpy
+from vocabulary import TokenIndex
+try:
+  import scipy.sparse
+except ImportError:
+  scipy = None
+
+# Rough number of bytes needed per nonzero of a block product, counting
+# the two products, their sum and the temporaries scipy makes on the way.
+BYTES_PER_NONZERO = 64
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+def available():
+  return scipy is not None
+
+def term_matrix(token_indexes, vocabulary=None):
+  """
+  Build a CSR matrix with one row per token index (a dict from token to
+  count) and one column per token. Returns the matrix and the vocabulary,
+  a dict from token to column.
+
+  TokenIndexes over a common Vocabulary already have integer token ids,
+  which are used as the columns directly.
+  """
+  token_indexes = list(token_indexes)
+  if vocabulary is None and token_indexes and isinstance(token_indexes[0], TokenIndex):
+    shared = token_indexes[0].vocabulary
+    if all(isinstance(i, TokenIndex) and i.vocabulary is shared for i in token_indexes):
+      return _id_matrix(token_indexes, shared), shared.ids
+  if vocabulary is None:
+    vocabulary = {}
+  indptr = [0]
+  indices = []
+  data = []
+  for index in token_indexes:
+    for token, count in index.iteritems():
+      if count:
+        indices.append(vocabulary.setdefault(token, len(vocabulary)))
+        data.append(count)
+    indptr.append(len(indices))
+  X = scipy.sparse.csr_matrix( ( numpy.array(data, dtype=numpy.float64)
+                               , numpy.array(indices, dtype=numpy.int64)
+                               , numpy.array(indptr, dtype=numpy.int64)
+                               )
+                             , shape=(len(indptr) - 1, len(vocabulary))
+                             )
+  X.sort_indices()
+  return X, vocabulary
+
+def _id_matrix(token_indexes, vocabulary):
+  nonzero = [i.counts != 0 for i in token_indexes]
+  indptr = numpy.zeros(len(token_indexes) + 1, dtype=numpy.int64)
+  numpy.cumsum([m.sum() for m in nonzero], out=indptr[1:])
+  indices = numpy.concatenate([numpy.zeros(0, dtype=numpy.int64)] + [i.ids[m] for i, m in zip(token_indexes, nonzero)])
+  data = numpy.concatenate([numpy.zeros(0)] + [i.counts[m] for i, m in zip(token_indexes, nonzero)])
+  return scipy.sparse.csr_matrix( (data.astype(numpy.float64), indices, indptr)
+                                , shape=(len(token_indexes), len(vocabulary))
+                                )
+
+def _binary(X):
+  B = X.copy()
+  B.data[:] = 1.0
+  return B
+
+def block_rows(n_docs, memory_budget=None):
+  """
+  Number of rows to compare against all n_docs documents at a time so
+  that a block product, in the worst case of every pair sharing a term,
+  stays within memory_budget bytes.
+  """
+  if memory_budget is None:
+    memory_budget = DEFAULT_MEMORY_BUDGET
+  return max(1, int(memory_budget // (BYTES_PER_NONZERO * max(1, n_docs))))
+
+def cosine_pairs(X, threshold, memory_budget=None):
+  """
+  Yield (i, j, similarity) for every pair of rows i < j of X whose
+  similarity, as computed by common.cosine_similarity on the rows' token
+  dicts, is at least threshold. That function sums the counts of the
+  tokens two indexes share, so this does the same:
+
+    sim(i, j) = sum over shared t of (X[i,t] + X[j,t]) / (|X[i]| |X[j]|)
+
+  which is (X B' + B X')[i,j] / (|X[i]| |X[j]|) for the binary pattern
+  B of X. Only pairs sharing at least one token can be found, so the
+  threshold must be positive.
+  """
+  if threshold <= 0:
+    raise ValueError, "cosine_pairs needs a positive threshold"
+  X = scipy.sparse.csr_matrix(X, dtype=numpy.float64)
+  B = _binary(X)
+  norms = numpy.sqrt(numpy.asarray(X.multiply(X).sum(axis=1)).ravel())
+  n = X.shape[0]
+  step = block_rows(n, memory_budget)
+  for start in xrange(0, n, step):
+    stop = min(n, start + step)
+    # Only compare against rows from start onwards: pairs with earlier
+    # rows were found by earlier blocks.
+    shared = (X[start:stop] * B[start:].T + B[start:stop] * X[start:].T).tocoo()
+    rows = shared.row + start
+    cols = shared.col + start
+    upper = rows < cols
+    rows, cols, acc = rows[upper], cols[upper], shared.data[upper]
+    w = norms[rows] * norms[cols]
+    nonzero = w != 0.0
+    rows, cols, acc, w = rows[nonzero], cols[nonzero], acc[nonzero], w[nonzero]
+    sim = acc / w
+    keep = sim >= threshold
+    for i, j, s in zip(rows[keep], cols[keep], sim[keep]):
+      yield int(i), int(j), float(s)
@@ -0,0 +1,343 @@
+"""
+Compact binary snapshots of Forum objects.
+
+A snapshot stores a forum column by column: an interned author table,
+int64 dates and offset-indexed string tables for ids, titles and post
+text. Loading a snapshot only reads the header; the file is memory-mapped
+and threads and posts are materialized the first time they are accessed,
+as columnar views (see the columnar module) whose text and dates are
+decoded on demand. This avoids paying for load_xml (clean(),
+datetime.fromtimestamp, ...) on every run.
+
+Dates are stored as the number of microseconds between the (naive) post
+date and the epoch, so they come back exactly as they were saved.
+
+Layout:
+  header     magic, format version, parser version, directory offset
+  sections   string tables and int64 columns, in any order
+  directory  section count, then (name, offset) for each section
+"""
+import os
+import mmap
+import struct
+import datetime as dt
+from array import array
+from itertools import islice
+from collections import defaultdict
+
+import numpy
+
+from DataModel import Author, PARSER_VERSION, load_xml
+from columnar import StringColumn, ColumnStore, ColumnarForum, ThreadView, PostView
+
+MAGIC = 'FFSNAP\r\n'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<8sIIQ')
+_COUNT = struct.Struct('<Q')
+_ENTRY = struct.Struct('<16sQ')
+_EPOCH = dt.datetime(1970, 1, 1)
+
+def _to_int(date):
+  delta = date - _EPOCH
+  return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def _from_int(value):
+  return _EPOCH + dt.timedelta(microseconds=value)
+
+# Columns are written and read this many values at a time.
+_CHUNK = 65536
+
+def _chunks(values):
+  values = iter(values)
+  while True:
+    chunk = list(islice(values, _CHUNK))
+    if not chunk:
+      return
+    yield chunk
+
+#####
+# Writing
+#####
+def _write_column(f, values):
+  """
+  An int64 column: count, then the values.
+  """
+  start = f.tell()
+  f.write(_COUNT.pack(0))
+  count = 0
+  for chunk in _chunks(values):
+    f.write(numpy.array(chunk, dtype='<i8').tostring())
+    count += len(chunk)
+  end = f.tell()
+  f.seek(start)
+  f.write(_COUNT.pack(count))
+  f.seek(end)
+
+def _write_strings(f, values):
+  """
+  A string table: count and blob length, the concatenated utf8 blob,
+  count+1 int64 offsets into the blob, then one flag byte per string
+  recording whether it was unicode (1) or a byte string (0).
+  """
+  start = f.tell()
+  f.write(_COUNT.pack(0) * 2)
+  # The offsets are kept as int64 arrays of up to _CHUNK values.
+  offsets = [numpy.zeros(1, dtype='<i8')]
+  pending = []
+  total = 0
+  flags = array('B')
+  for s in values:
+    if isinstance(s, unicode):
+      s = s.encode('utf8')
+      flags.append(1)
+    else:
+      flags.append(0)
+    f.write(s)
+    total += len(s)
+    pending.append(total)
+    if len(pending) == _CHUNK:
+      offsets.append(numpy.array(pending, dtype='<i8'))
+      pending = []
+  offsets.append(numpy.array(pending, dtype='<i8'))
+  end = f.tell()
+  f.seek(start)
+  f.write(_COUNT.pack(len(flags)))
+  f.write(_COUNT.pack(total))
+  f.seek(end)
+  for chunk in offsets:
+    f.write(chunk.tostring())
+  f.write(flags.tostring())
+
+def save_snapshot(forum, path):
+  authors = {}
+  def intern(name):
+    if name not in authors:
+      authors[name] = len(authors)
+    return authors[name]
+
+  posts = [p for t in forum.threads for p in t.posts]
+  post_start = [0]
+  for t in forum.threads:
+    post_start.append(post_start[-1] + len(t.posts))
+
+  sections = [ ('title', _write_strings, [forum.title or ''])
+             , ('thread_id', _write_strings, (t.id for t in forum.threads))
+             , ('thread_title', _write_strings, (t.title for t in forum.threads))
+             , ('thread_author', _write_column, (intern(t.author) for t in forum.threads))
+             , ('thread_date', _write_column, (_to_int(t.date) for t in forum.threads))
+             , ('thread_posts', _write_column, post_start)
+             , ('post_id', _write_strings, (p.id for p in posts))
+             , ('post_title', _write_strings, (p.title for p in posts))
+             , ('post_author', _write_column, (intern(p.author) for p in posts))
+             , ('post_date', _write_column, (_to_int(p.date) for p in posts))
+             , ('post_text', _write_strings, (p.text for p in posts))
+             ]
+
+  with open(path, 'wb') as f:
+    f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, PARSER_VERSION, 0))
+    directory = []
+    for name, write, values in sections:
+      directory.append((name, f.tell()))
+      write(f, values)
+    # The author table is only complete once every column referring
+    # to it has been written.
+    directory.append(('authors', f.tell()))
+    _write_strings(f, sorted(authors, key=authors.get))
+
+    directory_offset = f.tell()
+    f.write(_COUNT.pack(len(directory)))
+    for name, offset in directory:
+      f.write(_ENTRY.pack(name, offset))
+    f.seek(0)
+    f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, PARSER_VERSION, directory_offset))
+
+#####
+# Reading
+#####
+class MappedColumn(object):
+  """
+  An int64 column read in place from a snapshot, as a numpy array over
+  the memory map. Like StringColumn, values can still be replaced or
+  appended: they are kept apart from the read-only base.
+  """
+  def __init__(self, base):
+    self.base = base
+    self.changed = {}
+    self.tail = []
+
+  def __len__(self):
+    return len(self.base) + len(self.tail)
+
+  def __getitem__(self, i):
+    n = len(self.base)
+    if i < 0:
+      i += n + len(self.tail)
+    if i >= n:
+      return self.tail[i - n]
+    if i in self.changed:
+      return self.changed[i]
+    return int(self.base[i])
+
+  def __setitem__(self, i, value):
+    n = len(self.base)
+    if i < 0:
+      i += n + len(self.tail)
+    if i >= n:
+      self.tail[i - n] = value
+    else:
+      self.changed[i] = value
+
+  def append(self, value):
+    self.tail.append(value)
+
+  def __iter__(self):
+    for i in xrange(len(self)):
+      yield self[i]
+
+  def numpy(self):
+    """
+    The column as a numpy array: the base itself if nothing has been
+    replaced or appended, otherwise a copy.
+    """
+    if not self.changed and not self.tail:
+      return self.base
+    column = numpy.concatenate([self.base, numpy.array(self.tail, dtype=self.base.dtype)])
+    for i, value in self.changed.iteritems():
+      column[i] = value
+    return column
+
+def _read_column(buf, offset):
+  count = _COUNT.unpack_from(buf, offset)[0]
+  return MappedColumn(numpy.frombuffer(buf, '<i8', count, offset + _COUNT.size))
+
+def _read_strings(buf, offset):
+  """
+  Wrap a string table as a StringColumn whose strings are read from
+  the memory-mapped blob when accessed.
+  """
+  count, blob_len = struct.unpack_from('<2Q', buf, offset)
+  blob = offset + 2 * _COUNT.size
+  offsets = numpy.frombuffer(buf, '<i8', count + 1, blob + blob_len)
+  flags_offset = blob + blob_len + 8 * (count + 1)
+  flags = array('B', buf[flags_offset:flags_offset + count])
+  return StringColumn( buffer(buf, blob, blob_len)
+                     , MappedColumn(offsets[:-1])
+                     , MappedColumn(offsets[1:])
+                     , flags
+                     )
+
+class SnapshotStore(ColumnStore):
+  """
+  ColumnStore over a snapshot. Dates are kept in the snapshot's
+  representation (microseconds since the epoch).
+  """
+  def __init__(self, sections):
+    self.authors = list(_read_strings(*sections['authors']))
+    self.author_index = dict((a, i) for i, a in enumerate(self.authors))
+
+    self.thread_id = _read_strings(*sections['thread_id'])
+    self.thread_title = _read_strings(*sections['thread_title'])
+    self.thread_author = _read_column(*sections['thread_author'])
+    self.thread_timestamp = _read_column(*sections['thread_date'])
+
+    self.post_id = _read_strings(*sections['post_id'])
+    self.post_title = _read_strings(*sections['post_title'])
+    self.post_text = _read_strings(*sections['post_text'])
+    self.post_author = _read_column(*sections['post_author'])
+    self.post_timestamp = _read_column(*sections['post_date'])
+
+    self.thread_posts = _read_column(*sections['thread_posts'])
+    starts = self.thread_posts.base
+    self.post_thread = MappedColumn(numpy.repeat(numpy.arange(len(starts) - 1), numpy.diff(starts)))
+
+  def encode_date(self, timestamp):
+    return _to_int(dt.datetime.fromtimestamp(timestamp))
+
+  def decode_date(self, value):
+    return _from_int(value)
+
+  def numpy_column(self, name):
+    column = getattr(self, name)
+    if isinstance(column, MappedColumn):
+      return column.numpy()
+    return ColumnStore.numpy_column(self, name)
+
+class SnapshotForum(ColumnarForum):
+  """
+  A ColumnarForum backed by a memory-mapped snapshot. Opening it only
+  reads the header; the column store and the thread, post and author
+  objects are built the first time any of them is accessed.
+  """
+  _materialized = ('store', 'threads', 'thread_dict', 'posts', 'post_dict', 'authors')
+
+  def __init__(self, path):
+    with open(path, 'rb') as f:
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buf = self._mmap
+    magic, format_version, parser_version, directory_offset = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+      raise ValueError, "%s is not a forum snapshot" % path
+    if format_version != FORMAT_VERSION or parser_version != PARSER_VERSION:
+      raise ValueError, "Stale snapshot %s (format %d, parser %d)" % (path, format_version, parser_version)
+
+    self._sections = {}
+    count = _COUNT.unpack_from(buf, directory_offset)[0]
+    for i in range(count):
+      name, offset = _ENTRY.unpack_from(buf, directory_offset + _COUNT.size + i * _ENTRY.size)
+      self._sections[name.rstrip('\0')] = (buf, offset)
+
+    self.title = _read_strings(*self._sections['title'])[0]
+    self.token_index = None
+    self.tokenizer = None
+    self.vocabulary = None
+    self.dirty_threads = []
+    self._content_hash = None
+
+  def __getattr__(self, name):
+    # Only reached for attributes not yet set on the instance.
+    if name in self._materialized:
+      self._materialize()
+      return self.__dict__[name]
+    raise AttributeError, name
+
+  def _materialize(self):
+    store = self.store = SnapshotStore(self._sections)
+    self.threads = []
+    self.thread_dict = {}
+    self.posts = []
+    self.post_dict = {}
+    self.authors = defaultdict(Author)
+
+    for i in range(len(store.thread_author)):
+      thread = ThreadView.view(store, i, self)
+      self.threads.append(thread)
+      self.thread_dict[thread.id] = thread
+      self.authors[thread.author].add_Thread(thread)
+      for j in range(store.thread_posts[i], store.thread_posts[i+1]):
+        post = PostView.view(store, j, thread)
+        thread._add_view(post)
+        self.authors[post.author].add_Post(post)
+        self.posts.append(post)
+        self.post_dict[post.id] = post
+
+def load_snapshot(path):
+  return SnapshotForum(path)
+
+def load_cached(xml_path, snapshot_path=None):
+  """
+  Load a forum from its snapshot if there is an up-to-date one, otherwise
+  parse the xml and (re)build the snapshot. A snapshot is out of date if
+  it is older than the xml, or was written by a different parser or
+  format version.
+  """
+  if snapshot_path is None:
+    snapshot_path = xml_path + '.snapshot'
+  if os.path.exists(snapshot_path) and os.path.getmtime(snapshot_path) >= os.path.getmtime(xml_path):
+    try:
+      return load_snapshot(snapshot_path)
+    except ValueError:
+      pass
+  forum = load_xml(xml_path)
+  save_snapshot(forum, snapshot_path)
+  return forum
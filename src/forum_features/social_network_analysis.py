@@ -1,90 +1,268 @@
 import networkx as nx
 from collections import defaultdict
-from common import cosine_similarity
-import shelve
-import uuid
+from itertools import combinations
+from common import cosine_similarity, overlap
+import similarity
+import minhash
+import os
+import sqlite3
+import cPickle
+from array import array
+import time
 import logging
+from DataModel import Author
 
 # Implementing feature generation methods from Fortuna, Rodrigues and Milic-Frayling
 
 #####
 # Network Cache
 #####
+def forum_fingerprint(forum):
+  """
+  Identifies the forum data a network was computed from: the forum's
+  content_hash, and the tokenizer its token indexes came from.
+  """
+  tokenizer = getattr(forum.tokenizer, '__name__', repr(forum.tokenizer))
+  return '%s:%s' % (forum.content_hash, tokenizer)
+
+def _forum_nodes(forum, kind):
+  # Nodes are stored by their key in the forum, authors by name and
+  # threads by id. forum.authors is a defaultdict, so it is only read
+  # with get.
+  if kind == 'author':
+    return forum.authors
+  return forum.thread_dict
+
+def network_edges(net, forum):
+  """
+  Reduce a network to what is needed to rebuild it over a forum: its
+  class, edge function and graph attributes, the keys of its nodes in
+  the forum (author names or thread ids) in node order, its edges as
+  arrays of integer node ids (positions in the list of keys), and the edge
+  weights if the edges carry nothing but a weight. Any other edge data
+  is kept as a list of dicts.
+  """
+  nodes = net.nodes()
+  kind = 'author' if nodes and isinstance(nodes[0], Author) else 'thread'
+  key_of = dict((id(n), k) for k, n in _forum_nodes(forum, kind).iteritems())
+  keys = [key_of[id(n)] for n in nodes]
+  node_id = dict((id(n), i) for i, n in enumerate(nodes))
+  sources, targets = array('l'), array('l')
+  data = []
+  for A, B, d in net.edges_iter(data=True):
+    sources.append(node_id[id(A)])
+    targets.append(node_id[id(B)])
+    data.append(d)
+  weights = edge_data = None
+  if data and all(d.keys() == ['weight'] for d in data):
+    weights = [d['weight'] for d in data]
+    typecode = 'l' if all(isinstance(w, int) for w in weights) else 'd'
+    weights = (typecode, array(typecode, weights).tostring())
+  elif any(data):
+    edge_data = data
+  return { 'class': type(net)
+         , 'edge_fn': net.edge_fn
+         , 'graph': dict(net.graph)
+         , 'kind': kind
+         , 'keys': keys
+         , 'sources': sources.tostring()
+         , 'targets': targets.tostring()
+         , 'weights': weights
+         , 'edge_data': edge_data
+         }
+
+def rebuild_network(record, forum):
+  """
+  Rebuild a network reduced by network_edges, binding its nodes to the
+  authors or threads of forum. Raises KeyError if forum lacks one of
+  them.
+  """
+  forum_nodes = _forum_nodes(forum, record['kind'])
+  nodes = []
+  for key in record['keys']:
+    node = forum_nodes.get(key)
+    if node is None:
+      raise KeyError, "%s %r is not in the forum" % (record['kind'], key)
+    nodes.append(node)
+  def bind(ids):
+    a = array('l')
+    a.fromstring(ids)
+    return [nodes[i] for i in a]
+  net = record['class'](record['edge_fn'])
+  net.graph.update(record['graph'])
+  net.add_nodes_from(nodes)
+  edges = zip(bind(record['sources']), bind(record['targets']))
+  if record['weights'] is not None:
+    typecode, values = record['weights']
+    weights = array(typecode)
+    weights.fromstring(values)
+    net.add_weighted_edges_from((A, B, w) for (A, B), w in zip(edges, weights))
+  elif record['edge_data'] is not None:
+    net.add_edges_from((A, B, d) for (A, B), d in zip(edges, record['edge_data']))
+  else:
+    net.add_edges_from(edges)
+  return net
+
 class NetworkCache:
   """
-  Quick implementation of a persistency solution for networks, using the
-  python shelve module. Shelve mysteriously demands that all keys be
-  ints or strs, so we get around this by keeping our own index of the
-  keys in a standard dict, which maps from a full key to a uuid-generated
-  shelve key. We keep the index in memory, and persist it in the shelf
-  under the key 'index'. We rewrite the whole index each time it is 
-  updated - there's no simple way for a partial update.
-  Networks must be calculated via computenetwork in order for output
-  to be cached. This also makes the assumption that the forum data is
-  static (we only use the forum name as an identifier!), and that the
-  functions are deterministic. The key used for caching is as follows:
-    key = (net_fn.__name__, forum.title, frozenset(kwargs.items()))
+  Persistent cache of computed networks, in a sqlite database. Networks
+  must be calculated via compute_network in order for output to be
+  cached. The key used for caching is as follows:
+    key = (net_fn.__name__, forum_fingerprint(forum), frozenset(kwargs.items()))
+  so a network is recomputed whenever the forum's content changes, and
+  the network functions are assumed to be deterministic. Networks are
+  stored as arrays of integer node ids (see network_edges), and bound to
+  the forum they are retrieved for. cache[key] = net and cache[key] still
+  store and return whole networks, pickled with their nodes, as the
+  shelve-based cache did. Each network is a row of its own, so storing or
+  deleting one does not rewrite the others, and the database runs in
+  WAL mode so that other processes can read it while it is written to.
+  With flag 'r' the database must already exist, and is opened so that
+  sqlite refuses to write to it; 'n' starts from an empty cache.
   """
   def __init__(self, path, flag='c'):
     self.logger = logging.getLogger('social_network_analysis')
-    self.cache = shelve.open(path, flag=flag, protocol=-1) 
-    if 'index' in self.cache:
-      self.index = self.cache['index']
+    self.readonly = flag == 'r'
+    if self.readonly and not os.path.exists(path):
+      raise IOError, "No network cache at %s" % path
+    self.db = sqlite3.connect(path)
+    self.db.text_factory = str
+    if self.readonly:
+      # sqlite3 in Python 2 cannot open a file:...?mode=ro uri.
+      self.db.execute("PRAGMA query_only = ON")
     else:
-      self.index = {}
-
-  def update(self, other):
-    for key in other:
-      self[key] = other[key]
+      self.db.execute("PRAGMA journal_mode=WAL")
+      with self.db:
+        self.db.execute( "CREATE TABLE IF NOT EXISTS networks "
+                         "( key TEXT PRIMARY KEY, net_fn TEXT, title TEXT, fingerprint TEXT"
+                         ", params TEXT, created REAL, nodes INTEGER, edges INTEGER"
+                         ", full_key BLOB, data BLOB )"
+                       )
+        if flag == 'n':
+          self.db.execute("DELETE FROM networks")
+
+  def close(self):
+    self.db.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  @staticmethod
+  def _key(key):
+    # frozensets have no stable repr.
+    if isinstance(key, tuple):
+      return repr(tuple(sorted(k) if isinstance(k, frozenset) else k for k in key))
+    return repr(key)
 
   def __iter__(self):
-    return iter(self.index)
+    return iter(self.keys())
+
+  def keys(self):
+    return [ cPickle.loads(str(k)) for k, in self.db.execute("SELECT full_key FROM networks") ]
+
+  def info(self):
+    """
+    Metadata of the cached networks: a list of dicts with the network
+    function, forum title and fingerprint, parameters, creation time
+    and size of each.
+    """
+    rows = self.db.execute("SELECT net_fn, title, fingerprint, params, created, nodes, edges FROM networks")
+    return [ dict(zip(('net_fn', 'title', 'fingerprint', 'params', 'created', 'nodes', 'edges'), r)) for r in rows ]
 
   def __contains__(self, key):
-    return key in self.index
+    return self.db.execute("SELECT 1 FROM networks WHERE key = ?", (self._key(key),)).fetchone() is not None
+
+  def _record(self, key):
+    row = self.db.execute("SELECT data FROM networks WHERE key = ?", (self._key(key),)).fetchone()
+    return None if row is None else cPickle.loads(str(row[0]))
+
+  def get(self, key, forum):
+    """
+    The cached network for key bound to forum, or None. A network whose
+    nodes are not all in forum is treated as missing.
+    """
+    record = self._record(key)
+    if record is None:
+      return None
+    if 'network' in record:
+      return record['network']
+    try:
+      return rebuild_network(record, forum)
+    except KeyError, e:
+      self.logger.warning("cannot rebuild %r: %s", key, e)
+      return None
+
+  def _write(self, key, net, title, record):
+    if self.readonly:
+      return
+    if isinstance(key, tuple) and len(key) == 3:
+      net_fn, fingerprint, params = key[0], key[1], repr(sorted(key[2]))
+    else:
+      net_fn = fingerprint = params = None
+    with self.db:
+      self.db.execute( "INSERT OR REPLACE INTO networks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                     , ( self._key(key), net_fn, title, fingerprint, params
+                       , time.time(), net.number_of_nodes(), net.number_of_edges()
+                       , sqlite3.Binary(cPickle.dumps(key, cPickle.HIGHEST_PROTOCOL))
+                       , sqlite3.Binary(cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL)) )
+                     )
+
+  def put(self, key, net, forum):
+    self._write(key, net, forum.title, network_edges(net, forum))
 
   def __getitem__(self, key):
-    real_key = self.index[key]
-    return self.cache[real_key]
-    
-  def __setitem__(self, key, value):
-    if key in self.index:
-      real_key = self.index[key]
+    """
+    A network stored with cache[key] = net. Networks stored by put (and
+    so compute_network) can only be rebuilt over a forum, see get.
+    """
+    record = self._record(key)
+    if record is None:
+      raise KeyError, key
+    if 'network' not in record:
+      raise ValueError, "%r is stored as node ids, use get(key, forum)" % (key,)
+    return record['network']
+
+  def __setitem__(self, key, net):
+    self._write(key, net, None, {'network': net})
+
+  def update(self, other):
+    """
+    Copy the networks of other, a NetworkCache or a mapping of keys to
+    networks.
+    """
+    if isinstance(other, NetworkCache):
+      if self.readonly:
+        return
+      rows = other.db.execute("SELECT * FROM networks").fetchall()
+      with self.db:
+        self.db.executemany("INSERT OR REPLACE INTO networks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
     else:
-      real_key = str(uuid.uuid4())
-      self.index[key] = real_key
-    self.cache[real_key] = value
-    self.cache['index'] = self.index
+      for key in other:
+        self[key] = other[key]
 
   def __delitem__(self, key):
-    real_key = self.index[key]
-    try:
-      del self.cache[real_key]
-    except:
-      pass
-    del self.index[key]
-    self.cache['index'] = self.index
+    with self.db:
+      self.db.execute("DELETE FROM networks WHERE key = ?", (self._key(key),))
 
   def compute_network(self, net_fn, forum, **kwargs):
-    key = (net_fn.__name__, forum.title, frozenset(kwargs.items()))
+    key = (net_fn.__name__, forum_fingerprint(forum), frozenset(kwargs.items()))
     self.logger.info("Retrieving network for %s", str(key))
-    if key in self:
-      try:
-        net = self[key]
+    try:
+      net = self.get(key, forum)
+      if net is not None:
         return net
-      except Exception, e:
-        self.logger.warning("Failed with error: %s", str(e))
+    except Exception, e:
+      self.logger.warning("Failed with error: %s", str(e))
+      if not self.readonly:
         del self[key]
     self.logger.info("Computing network for %s", str(key))
     net = net_fn(forum, **kwargs)
-    self[key] = net
+    self.put(key, net, forum)
     return net
 
-    
-  def __del__(self):
-    self.cache['index'] = self.index
-    self.cache.close()
-
 ##########
 # Social Network Mixin
 ##########
@@ -124,6 +302,10 @@ class AuthorNetwork(SocialNetwork, nx.Graph):
     nx.Graph.__init__(self)
     
   def __call__(self, forum):
+    edges = self.edge_fn.edges(forum)
+    if edges is not None:
+      self.add_edges_from(edges)
+      return
     authors = [forum.authors[a] for a in sorted(forum.authors)]
     for i,A in enumerate(authors):
       for B in authors[i:]:
@@ -152,6 +334,10 @@ class DirectedAuthorNetwork(SocialNetwork, nx.DiGraph):
     nx.DiGraph.__init__(self)
     
   def __call__(self, forum):
+    edges = self.edge_fn.edges(forum)
+    if edges is not None:
+      self.add_edges_from(edges)
+      return
     authors = [forum.authors[a] for a in sorted(forum.authors)]
     for i,A in enumerate(authors):
       for B in authors[i:]:
@@ -184,6 +370,10 @@ class ThreadNetwork(SocialNetwork, nx.Graph):
     self.edge_fn = edge_fn
 
   def __call__(self, forum):
+    edges = self.edge_fn.edges(forum)
+    if edges is not None:
+      self.add_edges_from(edges)
+      return
     for i,T in enumerate(forum.threads):
       for Q in forum.threads[i:]:
         if T != Q and self.edge_fn(T, Q):
@@ -213,6 +403,58 @@ class EdgeFunction(object):
   def __call__(self, T, Q):
     return self.hasEdge(T,Q)
 
+  def edges(self, forum):
+    """
+    Fast path for network construction: return the (A, B) node pairs
+    for which hasEdge holds, or None if the network should test every
+    pair of nodes instead.
+    """
+    return None
+
+#####
+# Author co-participation index
+#####
+def coparticipation(forum):
+  """
+  Count, in a single pass over the threads, the number of threads each
+  pair of authors has both posted in. Returns a dict from (name, name)
+  pairs, in sorted order, to counts. Pairs that never share a thread
+  are absent.
+  """
+  counts = defaultdict(int)
+  for T in forum.threads:
+    for pair in combinations(sorted(T.post_authors), 2):
+      counts[pair] += 1
+  return counts
+
+def authors_by_name(forum):
+  """
+  Map author names to the Author objects carrying them. Only authors
+  with posts are included, as only they participate in threads.
+  """
+  names = defaultdict(list)
+  for A in forum.authors.values():
+    if A.posts:
+      names[A.name].append(A)
+  return names
+
+def coparticipant_pairs(forum, k=1):
+  """
+  Pairs of Author objects that have posted in at least k common threads.
+  """
+  names = authors_by_name(forum)
+  for (a, b), count in coparticipation(forum).iteritems():
+    if count >= k:
+      for A in names[a]:
+        for B in names[b]:
+          yield A, B
+  # Distinct Author objects can share a name, in which case each of them
+  # is found in every thread the other has posted in.
+  for same in names.itervalues():
+    for A, B in combinations(same, 2):
+      if min(len(A.all_threads), len(B.all_threads)) >= k:
+        yield A, B
+
 #####
 # Thread Network Edge Functions
 #####
@@ -224,9 +466,22 @@ class CommonAuthor(EdgeFunction):
     return len(T.post_authors & Q.post_authors) >= self.m
     
 class TextSimilarity(EdgeFunction):
-  def __init__(self, n, sim_fn):
+  def __init__(self, n, sim_fn, memory_budget=None):
     self.n = n
     self.sim_fn = sim_fn
+    self.memory_budget = memory_budget
+
+  def edges(self, forum):
+    # The vectorized search reproduces cosine_similarity only, and can
+    # only find pairs that share a token.
+    if self.sim_fn is not cosine_similarity or self.n <= 0 or not similarity.available():
+      return None
+    threads = forum.threads
+    if any(T.token_index is None for T in threads):
+      raise ValueError, "No token indexes!"
+    X, vocabulary = similarity.term_matrix(T.token_index for T in threads)
+    return [ (threads[i], threads[j]) 
+             for i, j, s in similarity.cosine_pairs(X, self.n, self.memory_budget) ]
 
   def hasEdge(self, T, Q):
     try:
@@ -236,6 +491,39 @@ class TextSimilarity(EdgeFunction):
     except AttributeError:
       raise ValueError, "No token indexes!"
 
+class ApproximateTextSimilarity(TextSimilarity):
+  """
+  TextSimilarity that only tests the pairs of threads proposed by
+  MinHash/LSH over their token indexes, trading a little recall for
+  roughly linear running time. See the minhash module for how bands and
+  rows affect recall.
+
+  LSH works on the Jaccard similarity of the token sets, which for
+  similar threads is lower than their cosine similarity, so the bands
+  and rows should put (1 / bands) ** (1 / rows) at or below n. The
+  defaults put it at 0.29, for the default n of 0.3: on the benchmark
+  forum of near duplicates (bench_minhash) they find about 92% of the
+  edges, at 1.5 times the speed of TextSimilarity on 8000 threads. The
+  old 20 bands of 5 rows (0.55) were faster but found 62%; 50 bands of 2
+  rows find 98%, but check so many pairs that they are slower than
+  TextSimilarity. The speedup grows with the number of threads; on a
+  few thousand threads TextSimilarity is about as fast.
+  """
+  def __init__(self, n, sim_fn, bands=40, rows=3, seed=0):
+    TextSimilarity.__init__(self, n, sim_fn)
+    self.bands = bands
+    self.rows = rows
+    self.seed = seed
+
+  def edges(self, forum):
+    threads = forum.threads
+    if any(T.token_index is None for T in threads):
+      raise ValueError, "No token indexes!"
+    pairs = minhash.candidate_pairs( [T.token_index for T in threads]
+                                   , self.bands, self.rows, self.seed)
+    return [ (threads[i], threads[j]) for i, j in sorted(pairs)
+             if self.hasEdge(threads[i], threads[j]) ]
+
 #####
 # Author Network Edge Functions
 #####
@@ -259,6 +547,57 @@ class PostAfter(EdgeFunction):
         if curr_post is None: break
         if curr_post.author == A.name: count += 1
     return count >= self.count
+
+  def edges(self, forum):
+    if self.count < 1:
+      return None
+    counts = post_after_counts(forum, self.dist)
+    return [ pair for pair, count in counts.iteritems() if count >= self.count ]
+
+def post_after_counts(forum, dist=1):
+  """
+  Count, for every ordered pair of authors (A, B), the number of times
+  A has posted within dist posts after B, as tested by PostAfter. Each
+  thread is walked once with a window of the dist posts following each
+  post, so thresholds can be picked from the counts without rebuilding
+  anything. Pairs with a count of zero are absent.
+  """
+  owner = {}
+  for B in forum.authors.itervalues():
+    for p in B.posts:
+      owner[id(p)] = B
+  follows = defaultdict(int)
+  for T in forum.threads:
+    posts = T.posts
+    first = {}
+    for i, p in enumerate(posts):
+      first.setdefault(p.id, i)
+    if len(first) == len(posts):
+      for i, p in enumerate(posts):
+        B = owner[id(p)]
+        for q in posts[i+1:i+1+dist]:
+          follows[q.author, B] += 1
+    else:
+      # next_by_thread goes on from the first post with the same id, as
+      # Post.position does.
+      for p in posts:
+        B = owner[id(p)]
+        j = first[p.id]
+        for step in xrange(dist):
+          j += 1
+          if j == len(posts):
+            break
+          q = posts[j]
+          follows[q.author, B] += 1
+          j = first[q.id]
+
+  names = authors_by_name(forum)
+  counts = {}
+  for (name, B), count in follows.iteritems():
+    for A in names[name]:
+      if A is not B:
+        counts[A, B] = count
+  return counts
     
 # Conversation network? A - B - A - B pattern?
 
@@ -267,11 +606,18 @@ class ThreadParticipation(EdgeFunction):
     self.k = k
 
   def hasEdge(self, A, B):
+    A_threads = A.all_threads
+    B_threads = B.all_threads
     # Ensure A is the one with less threads for computational efficiency
-    if len(A.all_threads) > len(B.all_threads): A,B = B,A
-    count = sum(1 for T in A.all_threads if B in T)
+    if len(A_threads) > len(B_threads): A,B,A_threads = B,A,B_threads
+    count = sum(1 for T in A_threads if B.name in T.post_authors)
     return count >= self.k
 
+  def edges(self, forum):
+    if self.k < 1:
+      return None
+    return list(coparticipant_pairs(forum, self.k))
+
 ##########
 # Concrete networks
 #########
@@ -280,8 +626,28 @@ def CommonAuthorsNetwork(forum, m = 3):
   g(forum)
   return g
 
-def TextSimilarityNetwork(forum, n=0.3):
-  g = ThreadNetwork(TextSimilarity(n, cosine_similarity))
+def TextSimilarityNetwork(forum, n=0.3, memory_budget=None):
+  """
+  Threads are connected if the cosine_similarity of their token indexes
+  is at least n. If scipy is available the pairs are found by sparse
+  matrix products, in blocks that fit in memory_budget bytes.
+  """
+  g = ThreadNetwork(TextSimilarity(n, cosine_similarity, memory_budget))
+  g(forum)
+  return g
+
+similarity_metrics = { 'cosine' : cosine_similarity
+                     , 'overlap': overlap
+                     }
+
+def ApproximateTextSimilarityNetwork(forum, n=0.3, metric='cosine', bands=40, rows=3, seed=0):
+  """
+  Approximation of TextSimilarityNetwork for large forums: candidate
+  pairs of threads come from MinHash/LSH, and are then checked with the
+  named similarity metric. See ApproximateTextSimilarity for the choice
+  of bands and rows.
+  """
+  g = ThreadNetwork(ApproximateTextSimilarity(n, similarity_metrics[metric], bands, rows, seed))
   g(forum)
   return g
 
@@ -290,6 +656,17 @@ def PostAfterNetwork(forum, dist=1, count=3):
   g(forum)
   return g
 
+def PostAfterCountsNetwork(forum, dist=1):
+  """
+  All the pairs PostAfter could connect, with the number of occasions
+  as the 'weight' of each edge. Thresholding the weights at count gives
+  PostAfterNetwork(forum, dist, count).
+  """
+  g = DirectedAuthorNetwork(PostAfter(dist=dist, count=1))
+  for (A, B), count in post_after_counts(forum, dist).iteritems():
+    g.add_edge(A, B, weight=count)
+  return g
+
 def ThreadParticipationNetwork(forum, k=5):
   g = AuthorNetwork(ThreadParticipation(k))
   g(forum)
@@ -0,0 +1,164 @@
+"""
+Integer token ids for token indexes.
+
+A Vocabulary maps tokens to dense integer ids. A TokenIndex stores the
+counts of a token index as two parallel numpy arrays, the sorted token
+ids and their counts, instead of a dict keyed by token strings, so that
+each token string is stored once per forum rather than once per post.
+TokenIndex behaves like the read side of the defaultdict(int) it
+replaces (indexing, `in`, iteration, keys/values/items), so existing
+feature code keeps working; common.overlap and common.cosine_similarity
+compare two TokenIndexes over the same Vocabulary by merging their id
+arrays instead of hashing strings.
+
+See Forum.intern_tokens.
+"""
+import numpy
+
+class Vocabulary(object):
+  """
+  Maps tokens to dense integer ids, in order of first appearance.
+  """
+  def __init__(self):
+    self.ids = {}
+    self.tokens = []
+
+  def __len__(self):
+    return len(self.tokens)
+
+  def __contains__(self, token):
+    return token in self.ids
+
+  def intern(self, token):
+    try:
+      return self.ids[token]
+    except KeyError:
+      self.ids[token] = len(self.tokens)
+      self.tokens.append(token)
+      return len(self.tokens) - 1
+
+  def get(self, token):
+    """
+    The id of a token, or None if it has not been seen.
+    """
+    return self.ids.get(token)
+
+class TokenIndex(object):
+  """
+  Token counts as sorted arrays of token ids and counts. Looking up a
+  missing token gives 0, like a defaultdict(int), but does not add it.
+  """
+  __slots__ = ('vocabulary', 'ids', 'counts')
+
+  def __init__(self, vocabulary, counts=None):
+    self.vocabulary = vocabulary
+    items = sorted((vocabulary.intern(t), c) for t, c in (counts or {}).iteritems())
+    if items:
+      self.ids = numpy.array([i for i, c in items], dtype=numpy.int64)
+      self.counts = numpy.array([c for i, c in items])
+    else:
+      self.ids = numpy.zeros(0, dtype=numpy.int64)
+      self.counts = numpy.zeros(0, dtype=numpy.int64)
+
+  def _find(self, token):
+    i = self.vocabulary.get(token)
+    if i is None:
+      return -1, None
+    pos = int(self.ids.searchsorted(i))
+    if pos < len(self.ids) and self.ids[pos] == i:
+      return pos, i
+    return -1, i
+
+  def __len__(self):
+    return len(self.ids)
+
+  def __contains__(self, token):
+    return self._find(token)[0] >= 0
+
+  def __getitem__(self, token):
+    pos, i = self._find(token)
+    return self.counts[pos].item() if pos >= 0 else 0
+
+  def __setitem__(self, token, count):
+    pos, i = self._find(token)
+    if pos >= 0:
+      self.counts[pos] = count
+    else:
+      if i is None:
+        i = self.vocabulary.intern(token)
+      pos = int(self.ids.searchsorted(i))
+      self.ids = numpy.insert(self.ids, pos, i)
+      self.counts = numpy.insert(self.counts, pos, count)
+
+  def __iter__(self):
+    tokens = self.vocabulary.tokens
+    return (tokens[i] for i in self.ids)
+
+  def __repr__(self):
+    return "<TokenIndex of %d tokens>" % len(self.ids)
+
+  def add_counts(self, counts):
+    """
+    Add counts (a mapping of tokens to counts) to the index, merging them
+    all into the id arrays at once rather than one insert per new token.
+    """
+    items = sorted((self.vocabulary.intern(t), c) for t, c in counts.iteritems())
+    if not items:
+      return
+    ids = numpy.array([i for i, c in items], dtype=numpy.int64)
+    add = numpy.array([c for i, c in items])
+    dtype = numpy.result_type(self.counts, add)
+    if self.counts.dtype != dtype:
+      self.counts = self.counts.astype(dtype)
+    present = shared(ids, self.ids)
+    self.counts[self.ids.searchsorted(ids[present])] += add[present]
+    new = ~present
+    if new.any():
+      merged_ids = numpy.concatenate((self.ids, ids[new]))
+      order = numpy.argsort(merged_ids, kind='mergesort')
+      self.ids = merged_ids[order]
+      self.counts = numpy.concatenate((self.counts, add[new]))[order]
+
+  def get(self, token, default=None):
+    pos, i = self._find(token)
+    return self.counts[pos].item() if pos >= 0 else default
+
+  def iterkeys(self):
+    return iter(self)
+
+  def itervalues(self):
+    return iter(self.counts.tolist())
+
+  def iteritems(self):
+    tokens = self.vocabulary.tokens
+    return ((tokens[i], c) for i, c in zip(self.ids.tolist(), self.counts.tolist()))
+
+  def keys(self):
+    return list(self.iterkeys())
+
+  def values(self):
+    return self.counts.tolist()
+
+  def items(self):
+    return list(self.iteritems())
+
+  def total(self):
+    return self.counts.sum().item()
+
+def shared(ids, other):
+  """
+  Boolean mask of the entries of the sorted id array ids that are also
+  in the sorted id array other: a merge join, done as one vectorized
+  binary search of ids into other.
+  """
+  if len(other) == 0:
+    return numpy.zeros(len(ids), dtype=bool)
+  pos = other.searchsorted(ids)
+  pos[pos == len(other)] = 0
+  return other[pos] == ids
+
+def compatible(a, b):
+  """
+  Whether a and b are TokenIndexes over the same Vocabulary.
+  """
+  return isinstance(a, TokenIndex) and isinstance(b, TokenIndex) and a.vocabulary is b.vocabulary
@@ -5,11 +5,13 @@ as described by
 Automatic Scoring of Online Discussion Posts, Wanas et. al.
 """
 
-import datetime
 import re
+import string
+from collections import defaultdict
 from common import check_tokenized, overlap, messenger_emoticons
 from itertools import groupby
 from DataModel import rbp_tokenize 
+import similarity
 
 def toSeconds(timedelta):
   return timedelta.days * 24 * 60 * 60 + timedelta.seconds
@@ -46,20 +48,57 @@ def overlapDistance(post):
     overlaps.append(overlap(post.token_index, p.token_index))
   return (i - overlaps.index(max(overlaps))) if overlaps != [] else 0
 
+def overlapFeatures(thread):
+  """
+  overlapPrevious and overlapDistance of every post in a thread, as a
+  list of (overlapPrevious, overlapDistance) pairs in post order.
+  The overlaps of every post with every other are computed at once, as
+  the sparse product of the posts' token counts with the posts' token
+  sets. Falls back on the per-post functions if scipy is missing.
+  """
+  posts = thread.posts
+  for p in posts:
+    check_tokenized(p)
+  if not similarity.available():
+    return [ (overlapPrevious(p), overlapDistance(p)) for p in posts ]
+
+  # Token sets include tokens with a count of zero, as overlap() does.
+  B, vocabulary = similarity.term_matrix(dict.fromkeys(p.token_index, 1) for p in posts)
+  C, vocabulary = similarity.term_matrix((p.token_index for p in posts), vocabulary)
+  common = (C * B.T).tocsr()
+  common.sort_indices()
+
+  positions = thread.stats.positions
+  features = []
+  for j, post in enumerate(posts):
+    # As in overlapPrevious, compare against the posts before the first
+    # one equal to this one.
+    k = positions[post.id]
+    if k == 0:
+      features.append((0.0, 0))
+      continue
+    cols = common.indices[common.indptr[j]:common.indptr[j+1]]
+    vals = common.data[common.indptr[j]:common.indptr[j+1]]
+    n = cols.searchsorted(k)
+    total = sum(post.token_index.values())
+    if n == 0 or total == 0:
+      # No overlap with any earlier post, so the first is the closest.
+      features.append((0.0, k))
+    else:
+      # argmax finds the first of several equal maxima, like list.index.
+      m = vals[:n].argmax()
+      features.append((float(vals[m]) / total, k - int(cols[m])))
+  return features
+
 ## Forum-specific Features
 # Would need quotation information to extract this, so skipping for now.
 
 ## Surface Features
 def timeliness(post):
   if post == post.thread.posts[0]: return 0.0
-  times = []
-  prev = post.thread.posts[0]
-  for p in post.thread.posts[1:]:
-    times.append(p.date - prev.date)
-    prev = p
-  mean_time = sum(times, datetime.timedelta()) / len(times)
   t = post.thread
-  td = post.date - t.posts[t.posts.index(post) - 1].date
+  mean_time = t.stats.mean_gap
+  td = post.date - t.posts[t.stats.positions[post.id] - 1].date
   try:
     r = float(toSeconds(td))/toSeconds(mean_time)
   except ZeroDivisionError:
@@ -71,8 +110,7 @@ def timeliness(post):
   return r
 
 def lengthiness(post):
-  lengths = [ len(p) for p in post.thread.posts ]
-  mean_l = sum(lengths) / float(len(lengths))
+  mean_l = post.thread.stats.mean_length
   r = len(post) / mean_l if mean_l else 0.0
   return r
   
@@ -83,18 +121,15 @@ def formatPunctuation(post):
   pass
 
 def formatEmoticons(post):
-  num_emot = sum(1 for e in messenger_emoticons if e in post.text)
-  num_sent = len(post.sentences)
+  num_emot = surface_counts(post)[0]
+  num_sent = post.sentence_stats['sentence']
   if num_sent == 0: return 0.0
   r = num_emot / float(num_sent)
   return r
 
 def formatCapitals(post):
-  cap_chunk_count = 0
-  for k, g in groupby(post.text, lambda x: str.isupper(x)):
-    if k:
-      cap_chunk_count += 1
-  num_sent = len(post.sentences)
+  cap_chunk_count = surface_counts(post)[2]
+  num_sent = post.sentence_stats['sentence']
   if num_sent == 0: return 0.0
   r = cap_chunk_count / float(num_sent)
   return r
@@ -102,26 +137,103 @@ def formatCapitals(post):
 ## Posting Component Features
 
 def weblinks(post):
-  link_count = len(re.compile("a href=", re.IGNORECASE).findall(post.text))
-  num_sent = len(post.sentences)
+  link_count = surface_counts(post)[1]
+  num_sent = post.sentence_stats['sentence']
   if num_sent == 0: return 0.0
   r = link_count / float(num_sent)
   return r
   
 
+## Surface scanner
+def _trie_pattern(words):
+  """
+  A regex matching any of words, factored by common prefixes so that it
+  branches on one character at a time, and preferring the longest match.
+  """
+  children = defaultdict(set)
+  for w in words:
+    if w:
+      children[w[0]].add(w[1:])
+  alternatives = [ re.escape(c) + _trie_pattern(children[c]) for c in sorted(children) ]
+  if not alternatives:
+    return ''
+  pattern = alternatives[0] if len(alternatives) == 1 else '(?:%s)' % '|'.join(alternatives)
+  if '' in words:
+    pattern = '(?:%s)?' % pattern
+  return pattern
+
+class SurfaceScanner(object):
+  """
+  Counts, in one pass over a text, what formatEmoticons, weblinks and
+  formatCapitals need: the number of entries of an emoticon list that
+  occur in the text (an emoticon listed twice counts twice), the number
+  of 'a href=' links (in any case), and the number of runs of uppercase
+  characters (as str.isupper sees them, in the current locale).
+  """
+  def __init__(self, emoticons):
+    self.multiplicity = defaultdict(int)
+    for e in emoticons:
+      self.multiplicity[e] += 1
+    # Every emoticon found at a position is a prefix of the longest one
+    # found there.
+    self.prefixes = dict( (e, [f for f in self.multiplicity if e.startswith(f)])
+                          for e in self.multiplicity )
+    upper = '[%s]' % re.escape(string.uppercase)
+    first = '[%s]' % re.escape(''.join(set(e[0] for e in self.multiplicity)))
+    # Each match is empty, at a position where an emoticon (group 1), a
+    # link (group 2) or a run of capitals (group 3, its first letter)
+    # starts, so that overlapping occurrences are all seen.
+    self.pattern = re.compile( '(?=%s|[aA]|%s)(?:(?=(%s)))?(?:(?=([aA] [hH][rR][eE][fF]=)))?(?:(?<!%s)(?=(%s)))?'
+                             % (first, upper, _trie_pattern(self.multiplicity), upper, upper) )
+
+  def __call__(self, text):
+    found = set()
+    links = runs = 0
+    for emoticon, link, capital in self.pattern.findall(text):
+      if emoticon:
+        found.add(emoticon)
+      if link:
+        links += 1
+      if capital:
+        runs += 1
+    present = set()
+    for e in found:
+      present.update(self.prefixes[e])
+    emoticons = sum(self.multiplicity[e] for e in present)
+    if isinstance(text, unicode):
+      # str.isupper, which the character class mirrors, does not apply.
+      runs = sum(1 for k, g in groupby(text, unicode.isupper) if k)
+    return emoticons, links, runs
+
+_scanners = {}
+
+def surface_counts(post):
+  """
+  (emoticons, links, capital runs) of the text of a post, see
+  SurfaceScanner. Kept on the post like its sentence stats, and dropped
+  with them by post.clear_cache.
+  """
+  if post._surface_counts is None:
+    key = string.uppercase
+    if key not in _scanners:
+      _scanners[key] = SurfaceScanner(messenger_emoticons)
+    post._surface_counts = _scanners[key](post.text)
+  return post._surface_counts
+
 # WeblinkQuality - Not feasible, in terms of bandwidth, and also links
 # die over time. 
 
 # Questioning - Not described in much detail
 
-def wanas_Post_features(post):
-  # tokenize if not yet done.
-  if post.thread.token_index is None:
-    post.thread.forum.run_tokenizer(rbp_tokenize)
+def _post_features(post, overlaps):
+  """
+  The features of a post, given its (overlapPrevious, overlapDistance).
+  """
+  previous, distance = overlaps
   features = dict()
   features['onThreadTopic'] = onThreadTopic(post)
-  features['overlapPrevious'] = overlapPrevious(post)
-  features['overlapDistance'] = overlapDistance(post)
+  features['overlapPrevious'] = previous
+  features['overlapDistance'] = distance
   features['timeliness'] = timeliness(post)
   features['lengthiness'] = lengthiness(post)
   features['formatEmoticons'] = formatEmoticons(post)
@@ -130,6 +242,21 @@ def wanas_Post_features(post):
   assert all((v >= 0.0 for v in features.values())), "Ended up with a negative feature!"
   return features
 
+def wanas_Post_features(post):
+  # tokenize if not yet done.
+  if post.thread.token_index is None:
+    post.thread.forum.run_tokenizer(rbp_tokenize)
+  return _post_features(post, (overlapPrevious(post), overlapDistance(post)))
+
+def wanas_Thread_features(thread):
+  """
+  wanas_Post_features of every post in a thread, in post order, with the
+  overlap features computed for the whole thread at once.
+  """
+  if thread.token_index is None:
+    thread.forum.run_tokenizer(rbp_tokenize)
+  return [ _post_features(post, overlaps) for post, overlaps in zip(thread.posts, overlapFeatures(thread)) ]
+
 # From wanas testing
   #f.run_tokenizer(rbp_tokenize)
   #for p in f.posts[:100]:
@@ -0,0 +1,37 @@
+"""
+Small random forums for the tests.
+"""
+import os
+import sys
+import random
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from DataModel import Forum
+
+WORDS = ( "the a to is it of and in that you for on with linux ubuntu kernel install driver "
+          "error version thanks help problem distribution newbie :) LOL OK"
+        ).split()
+ENDS = [' ', ' ', ' ', ', ', '. ', '? ', '! ', '\n']
+
+def random_text(rng, words):
+  return ''.join(rng.choice(WORDS) + rng.choice(ENDS) for i in xrange(words))
+
+def random_forum(forum=None, threads=60, posts=8, authors=10, words=20, seed=0):
+  """
+  A forum of threads of 1..posts posts each, of 1..words words each, by
+  authors authors. Threads and posts are added to forum if given.
+  """
+  rng = random.Random(seed)
+  if forum is None:
+    forum = Forum('f')
+  date = 1262304000.0
+  for t in xrange(threads):
+    initiator = 'user%d' % rng.randrange(authors)
+    forum.add_Thread(str(t), 'thread %d' % t, initiator, date)
+    for p in xrange(rng.randint(1, posts)):
+      author = initiator if p == 0 else 'user%d' % rng.randrange(authors)
+      date += rng.randint(1, 3600)
+      forum.add_Post(str(t), '%d.%d' % (t, p), 'Re', author, date, random_text(rng, rng.randint(1, words)))
+  return forum
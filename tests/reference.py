@@ -0,0 +1,359 @@
+"""
+The implementations that have since been replaced by faster ones, kept
+as the reference that the tests and benchmarks check the new ones
+against.
+"""
+import os
+import re
+import sys
+import time
+import string
+import random
+from HTMLParser import HTMLParser, HTMLParseError
+from htmlentitydefs import entitydefs
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from DataModel import Forum, PostList, parse_sentences, rbp_tokenize
+from adcs import ( additive_features, post_proportion_features, part_proportion_features
+                 , positional_features, sections )
+
+def legacy_parse_sentences(text):
+  """
+  The character-by-character parse_sentences that DataModel used before
+  the regex scanner, kept as the reference for its output.
+  """
+  from DataModel import Sentence
+  sentences = []
+  sentence = Sentence()
+  word = []
+  for i in range(len(text)):
+      char = text[i]
+      if char in string.letters or char in string.digits:
+          word.append(char.lower())
+      else:
+          if char in '\t ' and word:
+              sentence.append(''.join(word))
+              word = []
+          elif char in '?!\n.':
+              if char == '.' and ((word and (word[-1] in string.uppercase or word[-1] in string.digits)) or (i + 1 < len(text) and text[i+1] in string.letters)):
+                  word.append(char)
+              else:
+                  if word:
+                      sentence.append(''.join(word))
+                      if char == '\n' and word[-1] == '.':
+                          char = '.'
+                      word = []
+                  if sentence:
+                      sentence.tag(char)
+                      sentences.append(sentence)
+                      sentence = Sentence()
+  if word != []:
+    sentence.append(''.join(word))
+  if sentence != []:
+    sentences.append(sentence)
+  return sentences
+
+def legacy_surface_counts(text):
+  """
+  The emoticon, link and capital run counts as wanas computed them before
+  SurfaceScanner, one pass over the text each (and one per emoticon).
+  """
+  from itertools import groupby
+  from common import messenger_emoticons
+  emoticons = sum(1 for e in messenger_emoticons if e in text)
+  links = len(re.compile("a href=", re.IGNORECASE).findall(text))
+  runs = 0
+  for k, g in groupby(text, lambda x: str.isupper(x)):
+    if k:
+      runs += 1
+  return emoticons, links, runs
+
+class LegacyCleanPost(HTMLParser):
+  """
+  common.CleanPost as it was before it collected its output in a list
+  and skipped the parser for plain lines, kept as the reference for its
+  output.
+  """
+  def reset(self):
+    HTMLParser.reset(self)
+    self.text = ''
+
+  def __call__(self,data):
+    self.reset()
+    for l in data.split('\n'):
+      l = l.strip()
+      if l != '<br />':
+        try:
+          self.feed(l)
+          self.text += '\n'
+        except HTMLParseError:
+          self.text += l + '\n'
+    return self.text
+
+  def handle_data(self, data):
+    self.text += data
+
+  def handle_entityref(self, name):
+    try:
+      self.text += entitydefs[name]
+    except KeyError:
+      self.text += '<ENTITY>'
+
+  def handle_starttag(self, tag, attrs):
+    if tag == 'img':
+      self.text += '<IMAGE>'
+
+def legacy_load_xml(file):
+  """
+  load_xml as it was before iterparse: parse the whole document into
+  an element tree, then build the forum from it.
+  """
+  import xml.etree.cElementTree as etree
+  from xml.sax.saxutils import unescape
+  tree = etree.parse(file)
+  title = tree.find('title').text
+  forum = Forum(title)
+  for t_node in tree.findall('thread'):
+    thread_id = t_node.get('id')
+    title = unescape(t_node.find('title').text or '')
+    author = unescape(t_node.find('author').text or '')
+    date = float(t_node.find('date').text)
+    forum.add_Thread(thread_id, title, author, date)
+    for p_node in t_node.findall('post'):
+      post_id = p_node.get('id')
+      title = unescape(p_node.find('title').text or '')
+      author = unescape(p_node.find('author').text or '')
+      date = float(p_node.find('date').text)
+      t = p_node.find('text').text
+      if type(t) == unicode:         t = t.encode('utf8')
+      text = unescape(t if t is not None else '')
+      forum.add_Post(thread_id, post_id, title, author, date, text)
+  return forum
+
+def legacy_writexml(forum, writer):
+  """
+  Forum.writexml as it was before XMLWriter: build the whole element
+  tree (round-tripping each post through the parser, as Post.xml did),
+  indent it, then write it.
+  """
+  import xml.etree.cElementTree as etree
+  from cStringIO import StringIO
+  def indent(elem, level=0):
+      i = "\n" + level*"  "
+      if len(elem):
+          if not elem.text or not elem.text.strip():
+              elem.text = i + "  "
+          if not elem.tail or not elem.tail.strip():
+              elem.tail = i
+          for elem in elem:
+              indent(elem, level+1)
+          if not elem.tail or not elem.tail.strip():
+              elem.tail = i
+      else:
+          if level and (not elem.tail or not elem.tail.strip()):
+              elem.tail = i
+  e = forum.xml
+  for post in e.iter('post'):
+    f = StringIO()
+    etree.ElementTree(post).write(f)
+    etree.fromstring(f.getvalue())
+  indent(e)
+  tree = etree.ElementTree(e)
+  tree.write(writer)
+
+def legacy_sample(forum, k, seed=None):
+  """
+  Forum.sample as it was before it drew from its own random.Random:
+  seed the random module, and copy the sampled threads and posts into a
+  new Forum.
+  """
+  random.seed(seed)
+  subforum = Forum(forum.title+'_(k:%d,seed:%s)'%(k,str(seed)))
+  for thread in random.sample(forum.threads, k):
+    subforum.add_Thread(thread.id, thread.title, thread.author, time.mktime(thread.date.timetuple()))
+    for post in thread.posts:
+      subforum.add_Post(thread.id, post.id, post.title, post.author, time.mktime(post.date.timetuple()), post.text)
+  return subforum
+
+class BruteForce(object):
+  """
+  An edge function whose networks test every pair of nodes with its
+  hasEdge, as they all did before the edges fast paths.
+  """
+  def __init__(self, edge_fn):
+    self.edge_fn = edge_fn
+
+  def __call__(self, A, B):
+    return self.edge_fn.hasEdge(A, B)
+
+  def edges(self, forum):
+    return None
+
+def brute_force_network(network_class, edge_fn, forum):
+  net = network_class(BruteForce(edge_fn))
+  net(forum)
+  return net
+
+# The ADCS feature functions as they were before adcs computed each
+# post's features once per thread: the thread is tokenized again on
+# each call, and the sentences of a post are parsed again for each use.
+def legacy_ADCS_partition_thread(thread):
+  initialPost = PostList()
+  firstResponse = PostList()
+  allResponses = PostList()
+  finalPostInit = PostList()
+
+
+  # Adapted from rbp's implementation
+  feedback_received = False
+
+  ordered_posts = sorted(thread.posts)
+  #initiator = thread.author
+  # We go with rbp's definition instead.
+  initiator = ordered_posts[0].author
+  
+  for post in ordered_posts:
+    if not feedback_received:
+      if post.author == initiator:
+        initialPost.append(post)
+      else:
+        firstResponse.append(post)
+        feedback_received = True
+    elif post.author == initiator:
+      # Final post from the initiator seen so far.
+      finalPostInit = PostList([post])
+    else:
+      allResponses.append(post)
+
+  result = dict( initialPost = initialPost
+               , firstResponse = firstResponse
+               , allResponses = allResponses
+               , finalPostInit = finalPostInit
+               )
+  return result
+
+def legacy_ADCS_Thread_features(thread):
+  thread.run_tokenizer(rbp_tokenize)
+  parts = legacy_ADCS_partition_thread(thread)
+  features = {}
+  
+  total_words = 0.0
+  total_sentences = 0.0
+  total_posts = 0.0
+  for part in parts:
+    features[part] = legacy_ADCS_PostList_features(parts[part])
+    total_words += features[part]['words']
+    total_sentences += features[part]['sentence']
+    total_posts += features[part]['posts']
+
+
+  last_post = 0 # Keep track of the index of the last post we have processed
+  for part in sections:
+    features[part]['word_prop']     = features[part]['words'] / total_words
+    features[part]['sentence_prop'] = features[part]['sentence'] / total_sentences
+    features[part]['first_question_ratio'] = features[part]['sentence'] / features[sections[0]]['sentence']
+    
+    # Positional features
+    # The first post of this part is one more than the last post of the last part
+    features[part]['first_post_prop'] = last_post + 1 / total_posts 
+    # The last post of this part is the last post of the last part plus the 
+    # number of posts in this part
+    last_post += features[part]['posts']
+    features[part]['last_post_prop' ] = last_post / total_posts
+
+
+  # TODO: 
+  #       Prop of code sentences
+ 
+  fv = {} 
+  f_names = additive_features + post_proportion_features + part_proportion_features + positional_features
+  for section in sections:
+    section_f = features[section]
+    for f_name in f_names:
+      fv[section+'_'+f_name] = section_f[f_name]
+  return fv
+
+def legacy_ADCS_PostList_features(postlist):
+  features = {} 
+  features['posts'] = len(postlist)
+  post_features = [ legacy_ADCS_Post_features(p) for p in postlist ]
+
+  for f in additive_features + ['words', 'sentence']:
+    features[f] = sum( pf[f] for pf in post_features )
+
+  # TODO: Proportion of code sentences
+  for f in post_proportion_features:
+    total = sum( pf[f] for pf in post_features )
+    # Calculate as a proportion of total sentences
+    features[f] = (float(total) / features['sentence']) if features['sentence'] is not 0 else 0.0
+    
+  sentence_lengths = []
+  word_lengths = []
+  for p in postlist:
+    for s in parse_sentences(p.text):
+      sentence_lengths.append(len(s))
+      for w in s:
+        word_lengths.append(len(w))
+
+  try:
+    features['avg_sentence'] = sum(sentence_lengths) / float(len(sentence_lengths))
+    features['avg_word'] = sum(word_lengths) / float(len(word_lengths))
+  except ZeroDivisionError:
+    features['avg_sentence'] = 0
+    features['avg_word'] = 0
+
+  return features
+
+
+def legacy_ADCS_Post_features(post):
+  # Based on rbp's code. Trying to reproduce ADCS results as faithfully
+  # as possible
+  features = {}
+
+  # tokenize if this has not been done yet
+  if post.token_index is None:
+    post.run_tokenizer(rbp_tokenize)
+
+  # mention of distribution
+  features['distribution'] = False
+  for word in ["redhat", "rh", "fc" "fedora core", "ubuntu", "debian", "suse", "gentoo", "slackware"]:
+    if word in post.token_index:
+      features['distribution'] = True
+
+  # mention of "beginner title"
+  features['beginner'] = False
+  for word in ["noob", "noobie", "newb", "newbie", "n00b", "n00bie"]:
+    if word in post.token_index:
+      features['beginner'] = True
+
+  # emoticon presence
+  features["emoticons"] = re.compile("img src=", re.IGNORECASE).search(post.text) is not None
+  
+  # version numbers
+  features["version_numbers"] = re.compile("\d+\.\d?").search(post.text) is not None
+
+  # urls
+  features["urls"] = re.compile("(http|www\.)\S+\.\S+").search(post.text) is not None
+
+  # sentence types
+  features["words"] = 0
+  features["sentence"] = 0
+  features["question_sentence"] = 0
+  features["exclaim_sentence"] = 0
+  features["period_sentence"] = 0
+  features["other_sentence"] = 0
+  for s in parse_sentences(post.text):
+    features["words"] += len(s)
+    features["sentence"] += 1
+    if s.end == '?':
+      features["question_sentence"] += 1
+    elif s.end == '!':
+      features["exclaim_sentence"]  += 1
+    elif s.end == '.':
+      features["period_sentence"]   += 1
+    else:
+      features["other_sentence"]    += 1
+
+  return features
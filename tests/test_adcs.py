@@ -0,0 +1,74 @@
+"""
+adcs.ADCS_Thread_features against the feature functions it replaced
+(reference.legacy_ADCS_Thread_features), which work everything out
+again for each post list.
+"""
+import os
+import sys
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from DataModel import rbp_tokenize
+from columnar import ColumnarForum
+from adcs import ADCS_Thread_features, ADCS_PostList_features, ADCS_Post_features, ADCS_partition_thread
+from reference import legacy_ADCS_Thread_features
+from forums import random_forum
+
+def thread_features(fn, forum):
+  result = []
+  for thread in forum.threads:
+    try:
+      result.append(fn(thread))
+    except ZeroDivisionError:
+      result.append('ZeroDivisionError')
+  return result
+
+class TestThreadFeatures(unittest.TestCase):
+  def check(self, forum, expected=None):
+    if expected is None:
+      expected = random_forum(threads=len(forum.threads))
+    self.assertEqual(thread_features(ADCS_Thread_features, forum), thread_features(legacy_ADCS_Thread_features, expected))
+
+  def test_features(self):
+    forum = random_forum(threads=80)
+    self.check(forum)
+    # Again, with the tokens and sentences kept from the first run.
+    self.check(forum)
+
+  def test_columnar(self):
+    self.check(random_forum(ColumnarForum('c'), threads=80))
+
+  def test_tokenized(self):
+    for interned in (False, True):
+      forum = random_forum(threads=80)
+      forum.run_tokenizer(rbp_tokenize)
+      if interned:
+        forum.intern_tokens()
+      self.check(forum)
+
+  def test_other_tokenizer(self):
+    forum = random_forum(threads=80)
+    forum.run_tokenizer(lambda text: text.split())
+    self.check(forum)
+
+  def test_text_changed(self):
+    forum = random_forum(threads=80)
+    forum.run_tokenizer(rbp_tokenize)
+    thread_features(ADCS_Thread_features, forum)
+    expected = random_forum(threads=80)
+    for f in (forum, expected):
+      for post in f.posts[::3]:
+        post.text = u'ubuntu newbie http://example.com/x.html version 2.6 <img src=":)"> ' + post.text
+    self.check(forum, expected)
+
+  def test_post_list(self):
+    forum = random_forum(threads=40)
+    for thread in forum.threads:
+      for postlist in ADCS_partition_thread(thread).values():
+        self.assertEqual( ADCS_PostList_features(postlist, [ADCS_Post_features(p) for p in postlist])
+                        , ADCS_PostList_features(postlist) )
+
+if __name__ == '__main__':
+  unittest.main()
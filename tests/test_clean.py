@@ -0,0 +1,53 @@
+"""
+common.CleanPost against the class it replaced (reference.LegacyCleanPost)
+on random, mostly broken, html posts.
+"""
+import os
+import sys
+import random
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from common import CleanPost, clean_posts
+from reference import LegacyCleanPost
+
+# Words, whitespace, and pieces of markup that are often left unclosed
+# or cut in half.
+PIECES = ( 'linux', 'the', 'thanks', ':)', 'a<b', '1 < 2', 'x&y', '&amp;', '&foo;', '&#169;', '&'
+         , '<p>', '</p>', '<b>', '</b', '<a href="http://example.com/">', '<a href="', '</a>'
+         , '<img src="smile.gif" alt=":)" />', '<img src=', '<br />', '<br>', '<!--', '-->'
+         , '<!-- note -->', '<![CDATA[', ']]>', '<!DOCTYPE html>', '<?xml?>', '<script>', '</script>'
+         , '<style>', '</style>', '<', '>', '</', '"', "'", '=', ' ', ' ', '  ', '\t', '\n', '\n', '\r\n'
+         , '\n<br />\n'
+         )
+
+def random_post(rng):
+  return ''.join(rng.choice(PIECES) for i in xrange(rng.randint(0, 30)))
+
+class TestCleanPost(unittest.TestCase):
+  def test_fuzz(self):
+    rng = random.Random(0)
+    legacy, clean = LegacyCleanPost(), CleanPost()
+    for i in xrange(50000):
+      text = random_post(rng)
+      self.assertEqual(clean(text), legacy(text), repr(text))
+
+  def test_iter_clean(self):
+    rng = random.Random(1)
+    legacy, clean = LegacyCleanPost(), CleanPost()
+    for i in xrange(2000):
+      text = random_post(rng)
+      cuts = sorted(rng.randint(0, len(text)) for j in xrange(rng.randint(0, 5)))
+      chunks = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+      self.assertEqual(''.join(clean.iter_clean(chunks)), legacy(text), repr(chunks))
+
+  def test_clean_posts(self):
+    rng = random.Random(2)
+    legacy = LegacyCleanPost()
+    texts = [random_post(rng) for i in xrange(500)]
+    self.assertEqual(clean_posts(texts, workers=2, chunksize=50), map(legacy, texts))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,85 @@
+"""
+FeatureMatrix aggregates against common's aggregation of feature dicts
+(user_post_aggregate, ThreadPostFeatures), and extract_features in a
+pool of workers against extracting in this process.
+"""
+import os
+import sys
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from DataModel import rbp_tokenize
+from common import user_post_aggregate, ThreadPostFeatures
+from extraction import forum_feature_matrix, extract_features, ThreadPosts
+from adcs import ADCS_Thread_features
+from wanas import wanas_Post_features
+from forums import random_forum
+
+def partial_features(post):
+  """
+  Features that only some posts have, so that the means are taken over
+  different numbers of posts.
+  """
+  features = {'length': len(post.text)}
+  if '?' in post.text:
+    features['questions'] = post.text.count('?')
+  if post.author == 'user3':
+    features['user3'] = True
+  return features
+
+class TestFeatureMatrix(unittest.TestCase):
+  def assertFeaturesEqual(self, a, b):
+    self.assertEqual(sorted(a), sorted(b))
+    for key in a:
+      self.assertEqual(sorted(a[key]), sorted(b[key]), key)
+      for name in a[key]:
+        self.assertAlmostEqual(a[key][name], b[key][name], 9, (key, name))
+
+  def test_to_dicts(self):
+    forum = random_forum()
+    matrix = forum_feature_matrix(forum, [partial_features])
+    self.assertEqual(matrix.to_dicts(), [partial_features(p) for t in forum.threads for p in t.posts])
+
+  def test_mean_by_author(self):
+    forum = random_forum()
+    for extractors in ([partial_features], [wanas_Post_features, partial_features]):
+      def extractor(post):
+        features = {}
+        for e in extractors:
+          features.update(e(post))
+        return features
+      means = forum_feature_matrix(forum, extractors).mean_by_author()
+      self.assertEqual(sorted(means.rows), sorted(forum.authors))
+      self.assertFeaturesEqual(dict(zip(means.rows, means.to_dicts())), user_post_aggregate(forum, extractor))
+
+  def test_mean_by_thread(self):
+    forum = random_forum()
+    means = forum_feature_matrix(forum, [partial_features]).mean_by_thread()
+    self.assertEqual(means.rows, [t.id for t in forum.threads])
+    expected = ThreadPostFeatures(partial_features)
+    self.assertFeaturesEqual( dict(zip(means.rows, means.to_dicts()))
+                            , dict((t.id, expected(t)) for t in forum.threads) )
+
+class TestExtractFeatures(unittest.TestCase):
+  def check(self, forum, extractor):
+    calls = []
+    result = extract_features(forum, extractor, workers=2, chunksize=7, progress=lambda *a: calls.append(a))
+    self.assertEqual(result, extract_features(forum, extractor))
+    self.assertEqual(calls, [(i + 1, len(forum.threads)) for i in xrange(len(forum.threads))])
+
+  def test_workers(self):
+    for extractor in (ThreadPosts(wanas_Post_features), ADCS_Thread_features, ThreadPosts(partial_features)):
+      self.check(random_forum(threads=30), extractor)
+
+  def test_tokenized(self):
+    forum = random_forum(threads=30)
+    forum.run_tokenizer(rbp_tokenize)
+    self.check(forum, ThreadPosts(wanas_Post_features))
+    forum.intern_tokens()
+    self.check(forum, ThreadPosts(wanas_Post_features))
+    self.check(forum, ADCS_Thread_features)
+
+if __name__ == '__main__':
+  unittest.main()
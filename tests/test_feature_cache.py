@@ -0,0 +1,106 @@
+"""
+FeatureCache: cached features are those extract_features would compute,
+only changed threads are recomputed, and the least recently used entries
+are evicted first.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from extraction import extract_features, ThreadPosts
+from feature_cache import FeatureCache, extractor_name
+from adcs import ADCS_Thread_features
+from wanas import wanas_Post_features
+from forums import random_forum
+
+class CountingExtractor(object):
+  def __init__(self, extractor):
+    self.extractor = extractor
+    self.threads = []
+
+  def __call__(self, thread):
+    self.threads.append(thread.id)
+    return self.extractor(thread)
+
+class TestFeatureCache(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'features.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_hits(self):
+    forum = random_forum(threads=20)
+    extractor = CountingExtractor(ADCS_Thread_features)
+    cache = FeatureCache(self.path)
+    expected = extract_features(random_forum(threads=20), ADCS_Thread_features)
+    self.assertEqual(cache.extract(forum, extractor, version=1), expected)
+    self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 20, 20))
+    self.assertEqual(cache.extract(forum, extractor, version=1), expected)
+    self.assertEqual((cache.hits, cache.misses), (20, 20))
+    self.assertEqual(len(extractor.threads), 20)
+
+    # Only the changed thread is extracted again.
+    forum.threads[4].posts[0].text = u'changed? text!'
+    del extractor.threads[:]
+    features = cache.extract(forum, extractor, version=1)
+    self.assertEqual(extractor.threads, [forum.threads[4].id])
+    self.assertEqual(features, extract_features(forum, ADCS_Thread_features))
+    self.assertEqual((cache.hits, cache.misses, len(cache)), (39, 21, 21))
+    cache.close()
+
+    # The cache persists, and other versions miss it.
+    cache = FeatureCache(self.path)
+    del extractor.threads[:]
+    self.assertEqual(cache.extract(forum, extractor, version=1), features)
+    self.assertEqual(extractor.threads, [])
+    cache.extract(forum, extractor, version=2)
+    self.assertEqual(len(extractor.threads), 20)
+    cache.close()
+
+  def test_names(self):
+    self.assertEqual(extractor_name(ADCS_Thread_features), 'adcs.ADCS_Thread_features')
+    self.assertEqual(extractor_name(ThreadPosts(wanas_Post_features)), 'ThreadPosts(wanas.wanas_Post_features)')
+
+  def test_evict_entries(self):
+    cache = FeatureCache(self.path, max_entries=10)
+    forum = random_forum(threads=10)
+    cache.extract(forum, ADCS_Thread_features)
+    time.sleep(0.01)
+    # Use half of the threads, so that the other half are evicted first.
+    used = forum.threads[::2]
+    cache.get_many(extractor_name(ADCS_Thread_features), '', [t.content_hash for t in used])
+    time.sleep(0.01)
+    cache.extract(random_forum(threads=5, seed=1), ADCS_Thread_features)
+    self.assertEqual(len(cache), 10)
+    hashes = [t.content_hash for t in forum.threads]
+    found = cache.get_many(extractor_name(ADCS_Thread_features), '', hashes)
+    self.assertEqual(sorted(found), sorted(t.content_hash for t in used))
+    cache.close()
+
+  def test_evict_bytes(self):
+    cache = FeatureCache(self.path)
+    forum = random_forum(threads=20)
+    cache.extract(forum, ADCS_Thread_features)
+    total = cache.db.execute("SELECT sum(size) FROM features").fetchone()[0]
+    cache.close()
+    cache = FeatureCache(self.path, max_bytes=total // 2)
+    time.sleep(0.01)
+    new = random_forum(threads=1, seed=1).threads[0]
+    cache.extract(new.forum, ADCS_Thread_features)
+    size, = cache.db.execute("SELECT sum(size) FROM features").fetchone()
+    self.assertTrue(0 < size <= total // 2)
+    self.assertTrue(0 < len(cache) < 21)
+    # The new entry is the most recently used, so it is kept.
+    self.assertTrue(new.content_hash in cache.get_many(extractor_name(ADCS_Thread_features), '', [new.content_hash]))
+    cache.close()
+
+if __name__ == '__main__':
+  unittest.main()
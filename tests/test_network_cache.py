@@ -0,0 +1,161 @@
+"""
+NetworkCache: cached networks must be rebuilt whenever the forum they
+were computed from changes, a cache opened with flag 'r' is never
+written to, and networks reduced by network_edges are rebuilt as they
+were.
+"""
+import os
+import sys
+import shutil
+import sqlite3
+import cPickle
+import tempfile
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from columnar import ColumnarForum
+from DataModel import rbp_tokenize
+from social_network_analysis import ( NetworkCache, network_edges, rebuild_network, PostAfterNetwork
+                                    , PostAfterCountsNetwork, ThreadParticipationNetwork
+                                    , CommonAuthorsNetwork, TextSimilarityNetwork )
+from forums import random_forum
+
+def edge_set(net):
+  edges = set()
+  for A, B, d in net.edges_iter(data=True):
+    edge = (id(A), id(B)) if net.is_directed() else frozenset([id(A), id(B)])
+    edges.add((edge, tuple(sorted(d.items()))))
+  return edges
+
+class TestStale(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.cache = NetworkCache(os.path.join(self.dir, 'networks.db'))
+
+  def tearDown(self):
+    self.cache.close()
+    shutil.rmtree(self.dir)
+
+  def check(self, forum, mutate, net_fn=PostAfterNetwork, **kwargs):
+    before = self.cache.compute_network(net_fn, forum, **kwargs)
+    self.assertEqual(edge_set(before), edge_set(net_fn(forum, **kwargs)))
+    mutate(forum)
+    fresh = net_fn(forum, **kwargs)
+    self.assertEqual(edge_set(self.cache.compute_network(net_fn, forum, **kwargs)), edge_set(fresh))
+
+  def test_sort_posts(self):
+    def mutate(forum):
+      for thread in forum.threads:
+        thread.sort_posts(key=lambda p: p.author)
+    for forum in (random_forum(), random_forum(ColumnarForum('c'))):
+      self.check(forum, mutate, count=1)
+
+  def test_reindex(self):
+    def mutate(forum):
+      for thread in forum.threads:
+        thread.posts.reverse()
+        thread.reindex()
+    self.check(random_forum(), mutate, count=1)
+
+  def test_text(self):
+    forum = random_forum()
+    h = forum.content_hash
+    forum.posts[0].text = forum.posts[0].text + u' changed'
+    self.assertNotEqual(forum.content_hash, h)
+
+  def test_titles(self):
+    for forum in (random_forum(), random_forum(ColumnarForum('c'))):
+      h = forum.content_hash
+      forum.posts[3].title = u'new title'
+      self.assertNotEqual(forum.content_hash, h)
+    forum = random_forum()
+    h = forum.content_hash
+    forum.threads[3].title = u'new title'
+    self.assertNotEqual(forum.content_hash, h)
+class TestReadOnly(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'networks.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_missing(self):
+    self.assertRaises(IOError, NetworkCache, self.path, 'r')
+    self.assertFalse(os.path.exists(self.path))
+
+  def test_readonly(self):
+    forum = random_forum()
+    with NetworkCache(self.path) as cache:
+      cache.compute_network(PostAfterNetwork, forum, count=1)
+    with NetworkCache(self.path, 'r') as cache:
+      self.assertEqual(len(cache.keys()), 1)
+      net = cache.compute_network(ThreadParticipationNetwork, forum)
+      self.assertEqual(edge_set(net), edge_set(ThreadParticipationNetwork(forum)))
+      self.assertEqual(len(cache.keys()), 1)
+      # Writes that do not go through the cache's own checks fail too.
+      self.assertRaises(sqlite3.OperationalError, cache.__delitem__, cache.keys()[0])
+      self.assertRaises(sqlite3.OperationalError, cache.db.execute, "DELETE FROM networks")
+    with NetworkCache(self.path) as cache:
+      self.assertEqual(len(cache.keys()), 1)
+def keyed_edges(net, forum):
+  """
+  The edges of net as (key, key, data) with the keys of their nodes in
+  forum, to compare networks over different forums.
+  """
+  record = network_edges(net, forum)
+  key = dict((id(n), k) for n, k in zip(net.nodes(), record['keys']))
+  edges = set()
+  for A, B, d in net.edges_iter(data=True):
+    edge = (key[id(A)], key[id(B)]) if net.is_directed() else frozenset([key[id(A)], key[id(B)]])
+    edges.add((edge, tuple(sorted(d.items()))))
+  return edges
+
+class TestRoundTrip(unittest.TestCase):
+  def networks(self, forum):
+    forum.run_tokenizer(rbp_tokenize)
+    yield PostAfterNetwork(forum, count=1)
+    yield PostAfterCountsNetwork(forum, dist=2)
+    yield ThreadParticipationNetwork(forum, k=2)
+    yield CommonAuthorsNetwork(forum, m=2)
+    yield TextSimilarityNetwork(forum, n=0.5)
+    net = ThreadParticipationNetwork(forum, k=3)
+    net.graph['name'] = 'labelled'
+    for i, (A, B) in enumerate(net.edges()):
+      net[A][B]['label'] = 'edge %d' % i
+      if i % 2:
+        net[A][B]['weight'] = 0.5 * i
+    yield net
+    net = PostAfterCountsNetwork(forum)
+    for i, (A, B) in enumerate(net.edges()):
+      net[A][B]['weight'] = i + 0.25
+    yield net
+
+  def test_same_forum(self):
+    for forum in (random_forum(), random_forum(ColumnarForum('c'))):
+      for net in self.networks(forum):
+        self.assertTrue(net.number_of_edges() > 0)
+        record = cPickle.loads(cPickle.dumps(network_edges(net, forum), cPickle.HIGHEST_PROTOCOL))
+        rebuilt = rebuild_network(record, forum)
+        self.assertEqual(type(rebuilt), type(net))
+        self.assertEqual(type(rebuilt.edge_fn), type(net.edge_fn))
+        self.assertEqual(rebuilt.graph, net.graph)
+        self.assertEqual(set(map(id, rebuilt.nodes())), set(map(id, net.nodes())))
+        self.assertEqual(edge_set(rebuilt), edge_set(net))
+
+  def test_other_forum(self):
+    forum = random_forum()
+    for net in self.networks(forum):
+      record = cPickle.loads(cPickle.dumps(network_edges(net, forum), cPickle.HIGHEST_PROTOCOL))
+      copy = random_forum(ColumnarForum('c'))
+      rebuilt = rebuild_network(record, copy)
+      nodes = set(map(id, copy.authors.values() + copy.threads))
+      self.assertTrue(all(id(n) in nodes for n in rebuilt.nodes()))
+      self.assertEqual(keyed_edges(rebuilt, copy), keyed_edges(net, forum))
+      # A forum without some of the nodes cannot take the network.
+      self.assertRaises(KeyError, rebuild_network, record, random_forum(threads=5, authors=3))
+
+if __name__ == '__main__':
+  unittest.main()
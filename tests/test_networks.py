@@ -0,0 +1,73 @@
+"""
+The edges fast paths of the network edge functions against testing
+every pair of nodes with hasEdge (reference.brute_force_network).
+"""
+import os
+import sys
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from DataModel import rbp_tokenize
+from common import cosine_similarity
+from social_network_analysis import ( AuthorNetwork, DirectedAuthorNetwork, ThreadNetwork
+                                    , ThreadParticipation, PostAfter, TextSimilarity
+                                    , ThreadParticipationNetwork, PostAfterNetwork, PostAfterCountsNetwork
+                                    , TextSimilarityNetwork )
+import similarity
+from reference import brute_force_network
+from forums import random_forum
+
+def edge_set(net):
+  if net.is_directed():
+    return set((id(A), id(B)) for A, B in net.edges_iter())
+  return set(frozenset([id(A), id(B)]) for A, B in net.edges_iter())
+
+class TestThreadParticipation(unittest.TestCase):
+  def test_edges(self):
+    for seed in (0, 1):
+      forum = random_forum(threads=80, authors=15, seed=seed)
+      for k in (1, 2, 3, 5, 8):
+        expected = brute_force_network(AuthorNetwork, ThreadParticipation(k), forum)
+        self.assertEqual(edge_set(ThreadParticipationNetwork(forum, k)), edge_set(expected), (seed, k))
+
+class TestPostAfter(unittest.TestCase):
+  def test_edges(self):
+    for seed in (0, 1):
+      forum = random_forum(threads=80, authors=15, seed=seed)
+      for dist in (1, 2, 4):
+        weights = PostAfterCountsNetwork(forum, dist)
+        for count in (1, 2, 3, 6):
+          expected = edge_set(brute_force_network(DirectedAuthorNetwork, PostAfter(dist, count), forum))
+          self.assertEqual(edge_set(PostAfterNetwork(forum, dist, count)), expected, (seed, dist, count))
+          thresholded = set( (id(A), id(B)) for A, B, w in weights.edges_iter(data=True)
+                             if w['weight'] >= count )
+          self.assertEqual(thresholded, expected, (seed, dist, count))
+
+  def test_repeated_ids(self):
+    forum = random_forum(threads=20, authors=6)
+    thread = forum.threads[0]
+    for i in xrange(4):
+      forum.add_Post(thread.id, '0.0', 'Re', 'user%d' % (i % 2), 1362304000.0 + i, u'again')
+    for count in (1, 2):
+      expected = edge_set(brute_force_network(DirectedAuthorNetwork, PostAfter(1, count), forum))
+      self.assertEqual(edge_set(PostAfterNetwork(forum, 1, count)), expected, count)
+
+class TestTextSimilarity(unittest.TestCase):
+  def test_edges(self):
+    if not similarity.available():
+      self.skipTest("scipy is not installed")
+    forum = random_forum(threads=120, words=12)
+    forum.run_tokenizer(rbp_tokenize)
+    for interned in (False, True):
+      if interned:
+        forum.intern_tokens()
+      for n in (0.1, 0.3, 0.5, 0.8):
+        expected = edge_set(brute_force_network(ThreadNetwork, TextSimilarity(n, cosine_similarity), forum))
+        for budget in (None, 4096):
+          net = TextSimilarityNetwork(forum, n, memory_budget=budget)
+          self.assertEqual(edge_set(net), expected, (interned, n, budget))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,54 @@
+"""
+Post.position against posts.index, as posts are added, reordered and
+edited directly, and with repeated post ids.
+"""
+import os
+import sys
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from DataModel import Forum
+from columnar import ColumnarForum
+from forums import random_forum
+
+def check(test, thread):
+  for post in thread.posts:
+    test.assertEqual(post.position, thread.posts.index(post))
+
+class TestPosition(unittest.TestCase):
+  def test_add(self):
+    for forum in (Forum('f'), ColumnarForum('c')):
+      forum.add_Thread('t', 'title', 'user0', 1262304000.0)
+      thread = forum.thread_dict['t']
+      for i in xrange(50):
+        # Repeat some ids, which take the position of their first post.
+        forum.add_Post('t', str(i % 20 if i % 3 else i), 'Re', 'user%d' % (i % 4), 1262304000.0 + i, u'text %d' % i)
+        post = thread.posts[-1]
+        self.assertEqual(post.position, thread.posts.index(post))
+        # Working out the position does not need the thread stats.
+        self.assertTrue(thread._stats is None)
+      check(self, thread)
+
+  def test_reorder(self):
+    for forum in (random_forum(Forum('f')), random_forum(ColumnarForum('c'))):
+      threads = forum.threads
+      threads[0].posts.reverse()
+      threads[1].posts.insert(0, threads[1].posts[-1])
+      del threads[2].posts[1]
+      threads[3].sort_posts(key=lambda p: p.text)
+      for thread in threads[:4]:
+        check(self, thread)
+      threads[1].add_Post('new', 'Re', 'user0', 1362304000.0, u'new')
+      check(self, threads[1])
+
+  def test_stats(self):
+    forum = random_forum(Forum('f'), threads=5)
+    for thread in forum.threads:
+      thread.posts.reverse()
+      thread.reindex()
+      self.assertEqual(thread.stats.positions, dict((p.id, thread.posts.index(p)) for p in thread.posts))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,79 @@
+"""
+Forum.sample against the old copying sampler (reference.legacy_sample),
+and the views of Forum.sample_view, filter and split.
+"""
+import os
+import sys
+import random
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from DataModel import Forum
+from columnar import ColumnarForum
+from reference import legacy_sample
+from forums import random_forum
+
+def summary(forum):
+  return ( [(t.id, [p.id for p in t.posts]) for t in forum.threads]
+         , sorted((name, len(a.posts), len(a.threads)) for name, a in forum.authors.items())
+         )
+
+class TestSample(unittest.TestCase):
+  def test_sample(self):
+    forum = random_forum(Forum('f'))
+    for seed in (0, 1, 'x'):
+      random.seed(12345)
+      before = random.random()
+      random.seed(12345)
+      sample = forum.sample(20, seed)
+      self.assertEqual(random.random(), before)
+      self.assertEqual(type(sample), Forum)
+      self.assertEqual(summary(sample), summary(legacy_sample(forum, 20, seed)))
+
+  def test_views(self):
+    for forum in (random_forum(Forum('f')), random_forum(ColumnarForum('c'))):
+      expected = legacy_sample(forum, 20, 3)
+      views = [ forum.sample_view(20, 3)
+              , forum.filter(lambda t: t.id in expected.thread_dict)
+              ]
+      self.assertEqual(summary(views[0]), summary(expected))
+      self.assertEqual(sorted(summary(views[1])[0]), sorted(summary(expected)[0]))
+      self.assertEqual(summary(views[1])[1], summary(expected)[1])
+      for view in views + list(forum.split(0.3, 1)):
+        for thread in view.threads:
+          self.assertTrue(thread.forum is view)
+          self.assertTrue(all(p.thread is thread for p in thread.posts))
+        self.assertRaises(TypeError, view.add_Thread, 'new', 'new', 'user0', 1262304000.0)
+
+  def test_view_text(self):
+    forum = random_forum(ColumnarForum('c'))
+    before = forum.content_hash
+    parent = forum.threads[0].posts[0]
+    parent.sentences
+    view = forum.sample_view(len(forum.threads), 0)
+    post = view.thread_dict[parent.thread.id].posts[0]
+    self.assertRaises(TypeError, setattr, post, 'text', u'changed')
+    self.assertRaises(TypeError, setattr, post, 'title', u'changed')
+    self.assertEqual(post.text, parent.text)
+    self.assertEqual(forum.content_hash, before)
+    # The parent's posts can still be changed.
+    parent.text = u'changed. text'
+    self.assertEqual(len(parent.sentences), 2)
+    self.assertNotEqual(forum.content_hash, before)
+
+    plain = random_forum(Forum('f'))
+    post = plain.sample_view(5, 0).threads[0].posts[0]
+    post.text = u'changed'
+    self.assertNotEqual(plain.thread_dict[post.thread.id].posts[0].text, u'changed')
+
+  def test_split(self):
+    forum = random_forum(Forum('f'))
+    train, test = forum.split(0.3, 1)
+    self.assertEqual(len(train.threads), 18)
+    ids = [t.id for t in train.threads] + [t.id for t in test.threads]
+    self.assertEqual(sorted(ids), sorted(t.id for t in forum.threads))
+
+if __name__ == '__main__':
+  unittest.main()
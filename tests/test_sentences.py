@@ -0,0 +1,50 @@
+"""
+parse_sentences and iter_sentences against a fixed corpus of texts and
+the sentences the original character-by-character parser split them
+into (data/sentences.json).
+"""
+import os
+import sys
+import json
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from DataModel import parse_sentences, iter_sentences
+
+def load_golden():
+  with open(os.path.join(here, 'data', 'sentences.json')) as f:
+    return json.load(f)
+
+def as_lists(sentences):
+  return [[list(s), s.end] for s in sentences]
+
+class TestGoldenSentences(unittest.TestCase):
+  def setUp(self):
+    self.golden = load_golden()
+
+  def test_parse_sentences(self):
+    for text, expected in self.golden:
+      self.assertEqual(as_lists(parse_sentences(text)), expected, repr(text))
+
+  def test_parse_sentences_str(self):
+    for text, expected in self.golden:
+      try:
+        text = text.encode('ascii')
+      except UnicodeEncodeError:
+        continue
+      self.assertEqual(as_lists(parse_sentences(text)), expected, repr(text))
+
+  def test_iter_sentences(self):
+    for chunksize in (1, 2, 3, 7, 64, 65536):
+      for text, expected in self.golden:
+        self.assertEqual(as_lists(iter_sentences(text, chunksize)), expected, (chunksize, repr(text)))
+
+  def test_iter_sentences_chunks(self):
+    for text, expected in self.golden:
+      lines = text.splitlines(True)
+      self.assertEqual(as_lists(iter_sentences(iter(lines))), expected, repr(text))
+
+if __name__ == '__main__':
+  unittest.main()
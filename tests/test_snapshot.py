@@ -0,0 +1,61 @@
+"""
+Snapshots written by save_snapshot and read back by load_snapshot.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from snapshot import save_snapshot, load_snapshot
+from forums import random_forum
+
+def fields(forum):
+  return ( forum.title
+         , [(t.id, t.title, t.author, t.date) for t in forum.threads]
+         , [(p.id, p.title, p.author, p.date, p.text, p.thread.id) for t in forum.threads for p in t.posts]
+         )
+
+class TestSnapshot(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'forum.snapshot')
+    self.forum = random_forum(threads=100)
+    self.forum.add_Post('3', u'caf\xe9', u'T\xeftle', 'user1', 1262304000.123456, u'na\xefve text')
+    save_snapshot(self.forum, self.path)
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_round_trip(self):
+    snapshot = load_snapshot(self.path)
+    self.assertEqual(fields(snapshot), fields(self.forum))
+    again = os.path.join(self.dir, 'again.snapshot')
+    save_snapshot(snapshot, again)
+    self.assertEqual(open(again, 'rb').read(), open(self.path, 'rb').read())
+
+  def test_mapped(self):
+    store = load_snapshot(self.path).store
+    for name in ('post_timestamp', 'post_author', 'thread_timestamp', 'thread_author'):
+      column = store.numpy_column(name)
+      self.assertFalse(column.flags.owndata, name)
+      self.assertEqual(list(column), list(getattr(store, name)))
+    self.assertFalse(store.post_text.start.base.flags.owndata)
+
+  def test_changes(self):
+    snapshot = load_snapshot(self.path)
+    snapshot.posts[2].text = u'new text'
+    snapshot.add_Thread('new', 'new thread', 'user1', 1362304000.5)
+    snapshot.add_Post('new', 'new.0', 'Re', 'someone', 1362304001.25, 'more text')
+    self.forum.posts[2].text = u'new text'
+    self.forum.add_Thread('new', 'new thread', 'user1', 1362304000.5)
+    self.forum.add_Post('new', 'new.0', 'Re', 'someone', 1362304001.25, 'more text')
+    self.assertEqual(fields(snapshot), fields(self.forum))
+    post_thread = snapshot.store.numpy_column('post_thread')
+    self.assertEqual((len(post_thread), post_thread[-1]), (len(snapshot.posts), 100))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,30 @@
+"""
+wanas.SurfaceScanner against the separate emoticon, link and capital
+scans it replaced (reference.legacy_surface_counts).
+"""
+import os
+import sys
+import random
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from common import messenger_emoticons
+from wanas import SurfaceScanner
+from reference import legacy_surface_counts
+
+class TestSurfaceScanner(unittest.TestCase):
+  def test_fuzz(self):
+    rng = random.Random(0)
+    emoticons = list(set(messenger_emoticons))
+    pieces = ( 'a', 'A', 'href=', 'a href=', 'A HREF=', 'a hre', 'ok', 'OK', 'WTF', 'x', ' ', '\n', ':', '(', ')'
+             , '-', ';', 'H' )
+    scanner = SurfaceScanner(messenger_emoticons)
+    for i in xrange(20000):
+      text = ''.join( rng.choice(emoticons) if rng.random() < 0.3 else rng.choice(pieces)
+                      for j in xrange(rng.randint(0, 20)) )
+      self.assertEqual(scanner(text), legacy_surface_counts(text), repr(text))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,108 @@
+"""
+Forum.update_tokens against tokenizing the whole forum again, and
+tokenizing with a pool of workers against tokenizing in this process.
+"""
+import os
+import sys
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from DataModel import Forum, rbp_tokenize
+from columnar import ColumnarForum
+from vocabulary import TokenIndex
+from forums import random_forum
+
+class CountingTokenizer(object):
+  def __init__(self):
+    self.calls = 0
+
+  def __call__(self, text):
+    self.calls += 1
+    return rbp_tokenize(text)
+
+def indexes(forum):
+  return ( dict(forum.token_index)
+         , [dict(t.token_index) for t in forum.threads]
+         , [dict(p.token_index) for p in forum.posts]
+         )
+
+class TestUpdateTokens(unittest.TestCase):
+  def add(self, forum):
+    forum.add_Post('0', 'new.0', 'Re', 'user1', 1362304000.0, u'a new post about the kernel')
+    forum.add_Thread('new', 'new thread', 'user2', 1362304000.0)
+    for i in xrange(5):
+      forum.add_Post('new', 'new.%d' % (i + 1), 'Re', 'user%d' % i, 1362304000.0 + i, u'post %d of a new thread' % i)
+
+  def test_update(self):
+    tokenizer = CountingTokenizer()
+    forum = random_forum()
+    forum.run_tokenizer(tokenizer)
+    self.add(forum)
+    tokenizer.calls = 0
+    forum.update_tokens()
+    self.assertEqual(tokenizer.calls, 6)
+    expected = random_forum()
+    self.add(expected)
+    expected.run_tokenizer(tokenizer)
+    self.assertEqual(indexes(forum), indexes(expected))
+
+  def test_attach(self):
+    tokenizer = CountingTokenizer()
+    forum = random_forum(threads=30)
+    forum.run_tokenizer(tokenizer)
+    other = random_forum(threads=10, seed=1)
+    tokenizer.calls = 0
+    for thread in other.threads:
+      forum.attach_Thread(thread)
+    forum.update_tokens()
+    self.assertEqual(tokenizer.calls, len(other.posts))
+    expected = random_forum(threads=30)
+    for thread in random_forum(threads=10, seed=1).threads:
+      expected.attach_Thread(thread)
+    expected.run_tokenizer(tokenizer)
+    self.assertEqual(indexes(forum), indexes(expected))
+  def test_interned(self):
+    forum = random_forum()
+    forum.run_tokenizer(rbp_tokenize)
+    forum.intern_tokens()
+    # An untouched post is left alone, so a plain index put there stays plain.
+    clean = forum.threads[1].posts[0]
+    clean.token_index = dict(clean.token_index)
+    self.add(forum)
+    forum.update_tokens()
+    self.assertEqual(type(clean.token_index), dict)
+    for thread in (forum.thread_dict['0'], forum.thread_dict['new']):
+      self.assertTrue(isinstance(thread.token_index, TokenIndex))
+      self.assertTrue(all(isinstance(p.token_index, TokenIndex) for p in thread.posts))
+    self.assertTrue(isinstance(forum.token_index, TokenIndex))
+    expected = random_forum()
+    self.add(expected)
+    expected.run_tokenizer(rbp_tokenize)
+    self.assertEqual(indexes(forum), indexes(expected))
+class TestParallel(unittest.TestCase):
+  def test_parallel(self):
+    for make in (Forum, ColumnarForum):
+      expected = random_forum(make('f'), threads=40)
+      expected.run_tokenizer(rbp_tokenize)
+      # A chunksize that does not divide the number of posts.
+      forum = random_forum(make('f'), threads=40)
+      forum.run_tokenizer(rbp_tokenize, workers=2, chunksize=7)
+      self.assertEqual(indexes(forum), indexes(expected))
+      self.assertTrue(all(p.tokenizer is rbp_tokenize for p in forum.posts))
+      self.assertTrue(all(t.tokenizer is rbp_tokenize for t in forum.threads))
+
+  def test_interned(self):
+    expected = random_forum(threads=20)
+    expected.run_tokenizer(rbp_tokenize)
+    forum = random_forum(threads=20)
+    forum.run_tokenizer(rbp_tokenize)
+    forum.intern_tokens()
+    forum.run_tokenizer(rbp_tokenize, workers=2, chunksize=10)
+    self.assertTrue(isinstance(forum.token_index, TokenIndex))
+    self.assertTrue(all(isinstance(p.token_index, TokenIndex) for p in forum.posts))
+    self.assertEqual(indexes(forum), indexes(expected))
+
+if __name__ == '__main__':
+  unittest.main()
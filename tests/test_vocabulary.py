@@ -0,0 +1,36 @@
+"""
+TokenIndex against the defaultdict(int) token indexes it replaces.
+"""
+import os
+import sys
+import random
+import unittest
+from collections import defaultdict
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from vocabulary import Vocabulary, TokenIndex
+
+class TestAddCounts(unittest.TestCase):
+  def test_matches_dict(self):
+    rng = random.Random(0)
+    vocabulary = Vocabulary()
+    for trial in xrange(200):
+      counts = dict(('t%d' % rng.randrange(50), rng.randint(1, 5)) for i in xrange(rng.randrange(20)))
+      delta = dict(('t%d' % rng.randrange(80), rng.randint(1, 5)) for i in xrange(rng.randrange(20)))
+      index = TokenIndex(vocabulary, counts)
+      index.add_counts(delta)
+      expected = defaultdict(int, counts)
+      for token, count in delta.iteritems():
+        expected[token] += count
+      self.assertEqual(dict(index.iteritems()), dict(expected))
+      self.assertTrue((index.ids[1:] > index.ids[:-1]).all())
+
+  def test_float_counts(self):
+    index = TokenIndex(Vocabulary(), {'a': 1})
+    index.add_counts({'a': 0.5, 'b': 2.5})
+    self.assertEqual(dict(index.iteritems()), {'a': 1.5, 'b': 2.5})
+
+if __name__ == '__main__':
+  unittest.main()
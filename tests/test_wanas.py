@@ -0,0 +1,38 @@
+"""
+wanas_Thread_features against wanas_Post_features of each post.
+"""
+import os
+import sys
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from DataModel import rbp_tokenize
+from wanas import wanas_Post_features, wanas_Thread_features
+from forums import random_forum
+
+class TestThreadFeatures(unittest.TestCase):
+  def check(self, forum):
+    for thread in forum.threads:
+      self.assertEqual(wanas_Thread_features(thread), [wanas_Post_features(p) for p in thread.posts], thread.id)
+
+  def test_features(self):
+    self.check(random_forum(threads=40))
+
+  def test_repeated_ids(self):
+    forum = random_forum(threads=10, seed=1)
+    for thread in forum.threads[:5]:
+      first = thread.posts[0]
+      forum.add_Post(thread.id, first.id, 'Re', 'user1', 1362304000.0, first.text + u' again')
+      forum.add_Post(thread.id, thread.posts[-2].id, 'Re', 'user2', 1362304001.0, u'the kernel')
+    self.check(forum)
+
+  def test_interned(self):
+    forum = random_forum(threads=20, seed=2)
+    forum.run_tokenizer(rbp_tokenize)
+    forum.intern_tokens()
+    self.check(forum)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,109 @@
+"""
+load_xml and iter_xml, which stream the xml with iterparse, against the
+loader that parsed the whole document (reference.legacy_load_xml), and
+Forum.writexml, which streams through XMLWriter, against the writer that
+built the whole element tree (reference.legacy_writexml).
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src', 'forum_features'))
+
+from DataModel import Forum, XMLWriter, load_xml, iter_xml
+from columnar import ColumnarForum
+from reference import legacy_load_xml, legacy_writexml
+from forums import random_forum
+
+def fields(forum):
+  return ( forum.title
+         , [ (t.id, t.title, t.author, t.date, [(p.id, p.title, p.author, p.date, p.text) for p in t.posts])
+             for t in forum.threads ]
+         , sorted((name, len(a.posts), len(a.threads)) for name, a in forum.authors.items())
+         )
+
+def special_forum(forum=None):
+  """
+  A random forum, with some posts whose fields need escaping or are
+  empty, and a thread without posts.
+  """
+  forum = random_forum(forum, threads=30)
+  forum.add_Thread('empty', u'no posts', 'user0', 1362300000.0)
+  forum.add_Thread('x', u'caf\xe9 & <tags>', 'user&1', 1362304000.0)
+  forum.add_Post('x', 'x.0', u'"quotes" & \'apostrophes\'', 'user<2>', 1362304001.0, u'a &lt; b & c > d \xe9\u4e2d')
+  forum.add_Post('x', 'x.1', u'', 'user3', 1362304002.0, u'')
+  forum.add_Post('x', 'x.2', u'Re', 'user3', 1362304003.0, u'line\nbreaks\tand   spaces ')
+  forum.add_Thread('y&"z"', u'', '', 1362305000.0)
+  forum.add_Post('y&"z"', 'y<1>', u'', u'', 1362305001.0, u'<b>markup</b> &amp; entities')
+  return forum
+
+def xml_forum():
+  f = StringIO()
+  legacy_writexml(special_forum(), f)
+  return f.getvalue()
+
+class TestLoad(unittest.TestCase):
+  def test_load(self):
+    xml = xml_forum()
+    expected = fields(legacy_load_xml(StringIO(xml)))
+    self.assertEqual(fields(load_xml(StringIO(xml))), expected)
+    forum = load_xml(StringIO(xml), columnar=True)
+    self.assertTrue(isinstance(forum, ColumnarForum))
+    self.assertEqual(fields(forum), expected)
+
+  def test_iter(self):
+    xml = xml_forum()
+    expected = legacy_load_xml(StringIO(xml))
+    threads = list(iter_xml(StringIO(xml)))
+    self.assertEqual(len(threads), len(expected.threads))
+    for i, thread in enumerate(threads):
+      self.assertEqual(thread.forum.title, expected.title)
+      self.assertEqual(fields(thread.forum)[1], fields(expected)[1][i:i + 1])
+class TestWrite(unittest.TestCase):
+  def test_writexml(self):
+    for forum in (special_forum(Forum('f')), special_forum(ColumnarForum(u'caf\xe9 <forum>'))):
+      expected = StringIO()
+      legacy_writexml(forum, expected)
+      f = StringIO()
+      forum.writexml(f)
+      self.assertEqual(f.getvalue(), expected.getvalue())
+      self.assertEqual(fields(load_xml(StringIO(f.getvalue()))), fields(legacy_load_xml(StringIO(expected.getvalue()))))
+
+  def test_file_name(self):
+    forum = special_forum()
+    expected = StringIO()
+    legacy_writexml(forum, expected)
+    dir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(dir, 'forum.xml')
+      forum.writexml(path)
+      with open(path, 'rb') as f:
+        self.assertEqual(f.read(), expected.getvalue())
+    finally:
+      shutil.rmtree(dir)
+
+  def test_not_pretty(self):
+    forum = special_forum()
+    f = StringIO()
+    forum.writexml(f, pretty=False)
+    self.assertFalse('\n  <' in f.getvalue())
+    self.assertEqual(fields(load_xml(StringIO(f.getvalue()))), fields(load_xml(StringIO(xml_forum()))))
+
+  def test_invalid(self):
+    forum = random_forum(threads=3)
+    forum.add_Post('1', 'bad', 'Re', 'user0', 1362304000.0, u'not a character: \uffff')
+    f = StringIO()
+    writer = XMLWriter(f, forum.title)
+    writer.write_thread(forum.threads[0])
+    written = f.getvalue()
+    # Nothing of the thread is written.
+    self.assertRaises(ValueError, writer.write_thread, forum.threads[1])
+    self.assertEqual(f.getvalue(), written)
+    self.assertRaises(ValueError, legacy_writexml, forum, StringIO())
+
+if __name__ == '__main__':
+  unittest.main()